@@ -19,11 +19,54 @@ class Settings(BaseSettings):
     PERPLEXITY_MODEL: str = "llama-3.1-sonar-small-128k-chat"
     LLM_PREFER_CHEAPEST: bool = True
 
+    # Routing across providers: comma-separated fallbacks tried after LLM_PROVIDER
+    LLM_FALLBACK_PROVIDERS: str = ""
+    # End-to-end deadline budgets (seconds), default and per endpoint
+    LLM_DEADLINE_S: float = 60.0
+    LLM_DEADLINE_ASK_S: float = 30.0
+    LLM_DEADLINE_CHAT_S: float = 45.0
+    LLM_DEADLINE_ANALYZE_S: float = 60.0
+    # Hedged requests: fire the next target if the first has not answered by its p95
+    LLM_HEDGE_ENABLED: bool = True
+    LLM_HEDGE_MAX: int = 1
+    LLM_HEDGE_DELAY_S: float = 8.0  # used until enough latency samples are collected
+    LLM_HEDGE_MIN_DELAY_S: float = 1.0
+    # Circuit breakers per (provider, model)
+    LLM_BREAKER_WINDOW: int = 20
+    LLM_BREAKER_MIN_CALLS: int = 5
+    LLM_BREAKER_ERROR_RATE: float = 0.5
+    LLM_BREAKER_SLOW_CALL_S: float = 30.0
+    LLM_BREAKER_COOLDOWN_S: float = 30.0
+
     # OpenAI (legacy or for embeddings/chat if selected)
     OPENAI_API_KEY: str = ""
     OPENAI_MODEL: str = "gpt-4o-mini"
     OPENAI_EMBED_MODEL: str = "text-embedding-3-small"
-    EMBED_DIM: int = 1536
+    EMBED_DIM: int = 1536  # sent as `dimensions` to text-embedding-3-* models
+
+    # Embedding provider: "openai" or "local" (in-process hashed char n-gram vectorizer)
+    EMBED_PROVIDER: str = "openai"
+    LOCAL_EMBED_DIM: int = 1024
+
+    # On-disk memory-mapped embedding store per tenant (shared by all workers on a box)
+    EMBED_STORE_ENABLED: bool = False
+    EMBED_STORE_DIR: str = "var/embeddings"
+    EMBED_STORE_DTYPE: str = "float32"  # "float16" or "int8" (scalar quantization)
+    EMBED_STORE_DIM: int = 0  # Matryoshka truncation of stored vectors; 0 = keep EMBED_DIM
+    EMBED_RESCORE_FACTOR: int = 4  # candidates per result re-ranked at full precision
+
+    # Uploads: hard size limit; bodies are spooled to disk by the multipart parser
+    UPLOAD_MAX_BYTES: int = 25 * 1024 * 1024
+    UPLOAD_READ_CHUNK: int = 1024 * 1024
+
+    # Precompute the default AnalyzeRequest.query analysis right after upload
+    ANALYZE_PRECOMPUTE_ON_UPLOAD: bool = False
+
+    # Startup warmup (runs in the background; /ready reports 503 until it finishes)
+    WARMUP_ON_STARTUP: bool = False
+    WARMUP_DB_CONNECTIONS: int = 2
+    WARMUP_TENANTS: str = ""  # comma-separated tenants whose embedding stores are preloaded
+    WARMUP_TIMEOUT_S: float = 20.0
 
     # Ngrok token (used only by docker-compose service)
     NGROK_AUTHTOKEN: str = ""
@@ -1,16 +1,39 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from .config import settings
 from .routers import documents, analyze, ask_gpt
+from .services import warmup
+from .utils.body_limit import UploadLimitMiddleware
 
-app = FastAPI(title="Adil AI MVP", version="0.1.1")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Прогрев в фоне: порт открывается сразу, /ready покажет, когда всё готово
+    task = asyncio.create_task(warmup.run()) if settings.WARMUP_ON_STARTUP else None
+    yield
+    if task is not None and not task.done():
+        task.cancel()
+    await warmup.shutdown()
+
+
+app = FastAPI(title="Adil AI MVP", version="0.1.1", lifespan=lifespan)
 app.add_middleware(CORSMiddleware,
     allow_origins=[o.strip() for o in settings.ALLOWED_ORIGINS.split(",")],
     allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+# Лимит загрузки проверяется, пока тело принимается, а не после записи в спул
+app.add_middleware(UploadLimitMiddleware, max_bytes=settings.UPLOAD_MAX_BYTES)
 
 @app.get("/health")
 async def health(): return {"status": "ok"}
 
+@app.get("/ready")
+async def ready():
+    ok, checks = await warmup.readiness()
+    return JSONResponse({"status": "ready" if ok else "starting", "checks": checks}, status_code=200 if ok else 503)
+
 # Без Depends(auth_dep)
 app.include_router(documents.router, prefix="/v1")
 app.include_router(analyze.router,  prefix="/v1")
@@ -1,22 +1,81 @@
 
 import uuid
 from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy import String, ForeignKey, Integer, Text
+from datetime import datetime
+from sqlalchemy import String, ForeignKey, Integer, Text, LargeBinary, DateTime, Index, UniqueConstraint, func
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from .db import Base
 
 class Document(Base):
     __tablename__ = "documents"
+    # Keyset-пагинация списка документов тенанта: ORDER BY created_at DESC, id DESC
+    __table_args__ = (Index("ix_documents_tenant_created_id", "tenant_id", "created_at", "id"),)
     id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     tenant_id: Mapped[str] = mapped_column(String(64), index=True)
     filename: Mapped[str] = mapped_column(String(256))
-    content: Mapped[str] = mapped_column(Text)
+    content: Mapped[str] = mapped_column(Text)  # preview (first 10k chars); full text lives in DocumentText
+    content_hash: Mapped[str | None] = mapped_column(String(64), index=True, nullable=True)  # sha256 of the upload
+    version: Mapped[int] = mapped_column(Integer, default=1, server_default="1")  # current (latest) version
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+class DocumentVersion(Base):
+    """Ревизия документа: версия 1 — исходная загрузка, далее — загрузки через /versions."""
+    __tablename__ = "document_versions"
+    __table_args__ = (UniqueConstraint("document_id", "version"),)
+    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    document_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("documents.id", ondelete="CASCADE"), index=True)
+    version: Mapped[int] = mapped_column(Integer)
+    filename: Mapped[str] = mapped_column(String(256))
+    content_hash: Mapped[str] = mapped_column(String(64))
+    chunks: Mapped[int] = mapped_column(Integer)
+    embedded: Mapped[int] = mapped_column(Integer, default=0)  # chunks that needed a new embedding
+    reused: Mapped[int] = mapped_column(Integer, default=0)  # chunk rows carried over unchanged
+    removed: Mapped[int] = mapped_column(Integer, default=0)  # chunk rows closed by this version
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+class DocumentText(Base):
+    """Полный извлечённый текст, сжатый (zstd/gzip) — для повторного чанкинга без повторной загрузки."""
+    __tablename__ = "document_texts"
+    document_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("documents.id", ondelete="CASCADE"), primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, primary_key=True, default=1, server_default="1")
+    codec: Mapped[str] = mapped_column(String(8))
+    size: Mapped[int] = mapped_column(Integer)  # uncompressed length in characters
+    data: Mapped[bytes] = mapped_column(LargeBinary)
 
 class Chunk(Base):
     __tablename__ = "chunks"
+    __table_args__ = (Index("ix_chunks_document_ordinal", "document_id", "ordinal"),)
     id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     document_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("documents.id", ondelete="CASCADE"), index=True)
     tenant_id: Mapped[str] = mapped_column(String(64), index=True)
-    ordinal: Mapped[int] = mapped_column(Integer)
+    ordinal: Mapped[int] = mapped_column(Integer)  # position in the latest version the row is active in
     text: Mapped[str] = mapped_column(Text)
     embedding: Mapped[dict] = mapped_column("embedding", JSONB)  # stores list as JSON
+    embed_model: Mapped[str | None] = mapped_column(String(128), nullable=True)  # embed_id of the provider that built the vector; NULL = unknown, re-embedded
+    content_hash: Mapped[str | None] = mapped_column(String(64), nullable=True)  # sha256 of text, for version diffs
+    # Строка действует в версиях [version_from, version_to); version_to = NULL — в текущей
+    version_from: Mapped[int] = mapped_column(Integer, default=1, server_default="1")
+    version_to: Mapped[int | None] = mapped_column(Integer, nullable=True)
+
+class ChunkPosition(Base):
+    """Место чанка в версии документа: строка Chunk переиспользуется между версиями, даже если сдвинулась."""
+    __tablename__ = "chunk_positions"
+    __table_args__ = (Index("ix_chunk_positions_chunk_version", "chunk_id", "version"),)
+    document_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("documents.id", ondelete="CASCADE"), primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, primary_key=True)
+    ordinal: Mapped[int] = mapped_column(Integer, primary_key=True)
+    chunk_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("chunks.id", ondelete="CASCADE"))
+
+class AnalysisCache(Base):
+    """Готовый AnalyzeResponse по (документ, версия, нормализованный запрос, модель, версия промпта)."""
+    __tablename__ = "analysis_cache"
+    __table_args__ = (UniqueConstraint("document_id", "document_version", "query_hash", "model", "prompt_version", name="uq_analysis_cache_version_key"),)
+    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    document_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("documents.id", ondelete="CASCADE"), index=True)
+    document_version: Mapped[int] = mapped_column(Integer, default=1, server_default="1")
+    tenant_id: Mapped[str] = mapped_column(String(64), index=True)
+    query_hash: Mapped[str] = mapped_column(String(64))
+    model: Mapped[str] = mapped_column(String(128))  # routing key, see analysis_cache.model_key()
+    model_used: Mapped[str | None] = mapped_column(String(128), nullable=True)  # model that actually answered
+    prompt_version: Mapped[str] = mapped_column(String(64))
+    response: Mapped[dict] = mapped_column(JSONB)
@@ -1,12 +1,21 @@
 
+import json
+import logging
+from typing import Any, List, Optional
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from ..db import get_session_local, SKIP_DB
-from ..schemas import AnalyzeRequest, AnalyzeResponse, Citation
-from ..services.rag import build_prompt_and_citations, call_llm
+from ..schemas import AnalyzeRequest, AnalyzeResponse
+from ..services.rag import build_prompt_and_citations, build_response, call_llm, stream_llm, text_prompt, as_text
 from ..services.risk_rules import rule_flags
+from ..utils.json_stream import JsonFieldStream
+from ..services import analysis_cache
+from ..services.versioning import resolve_version
 from ..services.llm import LLMConfigurationError, LLMServiceError
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(tags=["analyze"])
 
 @router.post("/analyze/contract", response_model=AnalyzeResponse)
@@ -26,20 +35,21 @@ async def analyze(req: AnalyzeRequest):
             llm_out = await call_llm(prompt)
         except Exception as e:
             raise HTTPException(status_code=502, detail=f"Upstream LLM error: {e}")
-        risks_extra = rule_flags(llm_out.get("summary","") + " " + req.query)
-        return AnalyzeResponse(
-            summary=llm_out.get("summary",""),
-            risks=(llm_out.get("risks",[]) + risks_extra),
-            checklist=llm_out.get("checklist",[]),
-            citations=[],
-            model=llm_out.get("model","unknown")
-        )
+        return build_response(llm_out, req.query, [])
     
     SessionLocal = get_session_local()
     if SessionLocal is None:
         raise HTTPException(503, "Database connection is not available.")
     
     async with SessionLocal() as session:  # type: AsyncSession
+        version = await resolve_version(session, req.tenant_id, req.document_id, req.version)
+        if version is None:
+            raise HTTPException(404, "Document or version not found")
+        req.version = version
+        cached = await analysis_cache.get_cached(session, req.tenant_id, req.document_id, version, req.query)
+        if cached is not None:
+            return cached
+
         prompt, cits = await build_prompt_and_citations(session, req)
         try:
             llm_out = await call_llm(prompt)
@@ -56,11 +66,102 @@ async def analyze(req: AnalyzeRequest):
         except Exception as e:
             # Return upstream error to client without crashing the server
             raise HTTPException(status_code=502, detail=f"Upstream LLM error: {e}")
-        risks_extra = rule_flags(llm_out.get("summary","") + " " + req.query)
-        return AnalyzeResponse(
-            summary=llm_out.get("summary",""),
-            risks=(llm_out.get("risks",[]) + risks_extra),
-            checklist=llm_out.get("checklist",[]),
-            citations=[Citation(**c) for c in cits],
-            model=llm_out.get("model","unknown")
-        )
+        resp = build_response(llm_out, req.query, cits)
+        await analysis_cache.store(session, req.tenant_id, req.document_id, version, req.query, resp)
+        await session.commit()
+        return resp
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+# Имена SSE-событий для полей ответа LLM
+_STREAM_EVENTS = {"summary": "summary", "risks": "risk", "checklist": "checklist_item"}
+
+
+def _with_flags(resp: AnalyzeResponse, flags: List[str]) -> AnalyzeResponse:
+    return resp.model_copy(update={"risks": resp.risks + [f for f in flags if f not in resp.risks]})
+
+
+@router.post("/analyze/contract/stream")
+async def analyze_stream(req: AnalyzeRequest):
+    """SSE-вариант /analyze/contract.
+
+    События: ``citations`` и ``rule_flags`` (сразу, до первого токена LLM), затем ``summary``,
+    ``risk`` и ``checklist_item`` по мере готовности каждого элемента, в конце ``done``
+    с полным AnalyzeResponse (или ``error``).
+    """
+    if not req.document_id and not req.text:
+        raise HTTPException(400, "Provide document_id or raw text")
+
+    if SKIP_DB and req.document_id:
+        raise HTTPException(503, "Database is disabled. Use 'text' parameter instead of 'document_id'.")
+
+    cached: Optional[AnalyzeResponse] = None
+    prompt = ""
+    cits: List[dict] = []
+    SessionLocal = None
+    if SKIP_DB or req.text:
+        prompt = text_prompt(req)
+    else:
+        SessionLocal = get_session_local()
+        if SessionLocal is None:
+            raise HTTPException(503, "Database connection is not available.")
+        async with SessionLocal() as session:  # type: AsyncSession
+            version = await resolve_version(session, req.tenant_id, req.document_id, req.version)
+            if version is None:
+                raise HTTPException(404, "Document or version not found")
+            req.version = version
+            cached = await analysis_cache.get_cached(session, req.tenant_id, req.document_id, version, req.query)
+            if cached is None:
+                prompt, cits = await build_prompt_and_citations(session, req)
+
+    async def events():
+        if cached is not None:
+            yield _sse("citations", [c.model_dump(mode="json") for c in cached.citations])
+            # Промпт при попадании в кэш не строится — флаги по запросу и превью цитат
+            flags = rule_flags("\n".join([req.query] + [c.preview for c in cached.citations]))
+            yield _sse("rule_flags", flags)
+            yield _sse("done", _with_flags(cached, flags).model_dump(mode="json"))
+            return
+
+        yield _sse("citations", [
+            {**c, "document_id": str(c["document_id"]), "chunk_id": str(c["chunk_id"])} for c in cits
+        ])
+        # Детерминированные флаги по запросу и контексту готовы до ответа LLM
+        early_flags = rule_flags(prompt)
+        yield _sse("rule_flags", early_flags)
+
+        parser = JsonFieldStream()
+        model_used = "unknown"
+        try:
+            async for model_used, delta in stream_llm(prompt):
+                for key, value in parser.feed(delta):
+                    if key in _STREAM_EVENTS and value is not None:
+                        yield _sse(_STREAM_EVENTS[key], as_text(value))
+            llm_out = parser.result()
+            llm_out["model"] = model_used
+            resp = build_response(llm_out, req.query, cits)
+        except LLMConfigurationError:
+            yield _sse("error", {"detail": "Сервис временно недоступен из-за проблем с конфигурацией на сервере. Пожалуйста, обратитесь к администратору."})
+            return
+        except LLMServiceError:
+            yield _sse("error", {"detail": "Сервер временно недоступен. Пожалуйста, попробуйте позже."})
+            return
+        except Exception as e:
+            yield _sse("error", {"detail": f"Upstream LLM error: {e}"})
+            return
+
+        # В кэш — ответ без флагов по контексту: он общий с /analyze/contract, который их не считает
+        if SessionLocal is not None:
+            try:
+                async with SessionLocal() as session:  # type: AsyncSession
+                    await analysis_cache.store(session, req.tenant_id, req.document_id, req.version, req.query, resp)
+                    await session.commit()
+            except Exception:
+                # Ответ уже получен — ошибка кэша не должна обрывать стрим
+                logger.exception("Analysis cache store failed for document %s", req.document_id)
+        yield _sse("done", _with_flags(resp, early_flags).model_dump(mode="json"))
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
@@ -3,6 +3,7 @@ from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from typing import List, Literal, Optional
 
+from ..config import settings
 from ..schemas import Source
 from ..utils.citations import annotate_answer_with_citations
 from ..services.llm import chat_text, chat_messages, LLMConfigurationError, LLMServiceError
@@ -53,6 +54,7 @@ async def ask(req: AskRequest):
             temperature=temp,
             force_model=req.model,
             cheap_first=True,
+            deadline=settings.LLM_DEADLINE_ASK_S,
         )
     except LLMConfigurationError as e:
         raise HTTPException(
@@ -111,6 +113,7 @@ async def chat(req: ChatRequest):
             temperature=temp,
             force_model=req.model,
             cheap_first=True,
+            deadline=settings.LLM_DEADLINE_CHAT_S,
         )
     except LLMConfigurationError as e:
         raise HTTPException(
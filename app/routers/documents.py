@@ -1,26 +1,78 @@
+import asyncio
+import hashlib
 import os
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+import uuid
+from typing import List, Optional
+from uuid import UUID
+from fastapi import APIRouter, BackgroundTasks, UploadFile, File, Form, HTTPException, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from ..config import settings
+from sqlalchemy import func, select, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 from ..db import get_session_local, get_engine, Base, SKIP_DB
-from ..models import Document, Chunk
-from ..schemas import UploadResponse
+from ..models import Document, DocumentVersion, Chunk
+from ..schemas import (
+    UploadResponse, VersionUploadResponse, DocumentVersionInfo,
+    DocumentPage, DocumentSummary, DocumentDetail, ChunkPage, ChunkOut,
+)
 from ..services.extract import extract_text
-from ..services.embedding import embed_texts
+from ..services.embedding import embed_id, embed_texts
+from ..services.analysis_cache import precompute_default_analysis
+from ..services.text_store import load_full_text, make_document_text
+from ..services.versioning import (
+    add_version, chunks_in_version, embed_pending, pending_chunks, positions, reembed_stale, text_hash,
+)
+from ..utils.pagination import decode_cursor, encode_cursor
 from ..utils.text import chunk_text
 
 router = APIRouter(tags=["documents"])
 
+
+async def _hash_upload(file: UploadFile) -> str:
+    """Прочитать загрузку блоками (она уже лежит в спуле multipart-парсера), посчитать sha256
+    и проверить лимит размера, не поднимая файл в память целиком. Тело запроса уже ограничено
+    UploadLimitMiddleware; здесь — точная проверка размера самого файла."""
+    digest = hashlib.sha256()
+    size = 0
+    await file.seek(0)
+    while True:
+        block = await file.read(settings.UPLOAD_READ_CHUNK)
+        if not block:
+            break
+        size += len(block)
+        if size > settings.UPLOAD_MAX_BYTES:
+            raise HTTPException(413, f"File is too large. Maximum size is {settings.UPLOAD_MAX_BYTES} bytes.")
+        digest.update(block)
+    await file.seek(0)
+    return digest.hexdigest()
+
+
+async def _append_to_store(tenant_id: str, rows, embeddings) -> None:
+    if settings.EMBED_STORE_ENABLED and rows:
+        from ..services import vector_store  # lazy: NumPy нужен только при включённом хранилище
+        # flock и fsync блокируют — вне event loop
+        await asyncio.to_thread(vector_store.append, tenant_id, rows, embeddings)
+
+
+async def _refresh_duplicate(SessionLocal, tenant_id: str, document_id: UUID) -> None:
+    """Повторная загрузка того же файла: если векторы документа построены другим провайдером
+    (сменили EMBED_PROVIDER), пересчитать их, иначе документ выпал бы из поиска."""
+    rows, embeddings = await reembed_stale(SessionLocal, document_id)
+    await _append_to_store(tenant_id, rows, embeddings)
+
+
 # Инициализация БД на startup убрана - приложение запускается без подключения к БД
 
 @router.post("/documents/upload", response_model=UploadResponse)
-async def upload_document(file: UploadFile = File(...), tenant_id: str = Form(...)):
-    content_bytes = await file.read()
-    text = await extract_text(file.filename, content_bytes)
-    if not text or len(text.strip()) == 0:
-        raise HTTPException(400, "Empty text after extraction")
-
-    chunks = chunk_text(text, target_tokens=300)
-    embeddings = await embed_texts(chunks)
+async def upload_document(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    tenant_id: str = Form(...),
+    precompute_analysis: Optional[bool] = Form(None),
+):
+    if file.size is not None and file.size > settings.UPLOAD_MAX_BYTES:
+        raise HTTPException(413, f"File is too large. Maximum size is {settings.UPLOAD_MAX_BYTES} bytes.")
+    content_hash = await _hash_upload(file)
 
     if SKIP_DB:
         raise HTTPException(503, "Database is disabled. Set SKIP_DB=false to enable.")
@@ -29,15 +81,276 @@ async def upload_document(file: UploadFile = File(...), tenant_id: str = Form(..
     if SessionLocal is None:
         raise HTTPException(503, "Database connection is not available.")
 
+    # Дедупликация: тот же файл у того же тенанта не извлекаем и не эмбеддим повторно
+    async with SessionLocal() as session:  # type: AsyncSession
+        existing = (await session.execute(
+            select(Document.id).where(Document.tenant_id == tenant_id, Document.content_hash == content_hash).limit(1)
+        )).scalar_one_or_none()
+        if existing is not None:
+            n = (await session.execute(
+                select(func.count(Chunk.id)).where(Chunk.document_id == existing, Chunk.version_to.is_(None))
+            )).scalar_one()
+    if existing is not None:
+        await _refresh_duplicate(SessionLocal, tenant_id, existing)
+        return UploadResponse(document_id=existing, chunks=n, duplicate=True)
+
+    text = await extract_text(file.filename, file.file)
+    if not text or len(text.strip()) == 0:
+        raise HTTPException(400, "Empty text after extraction")
+
+    chunks = chunk_text(text, target_tokens=300)
+    embeddings = await embed_texts(chunks)
+
     async with SessionLocal() as session:  # type: AsyncSession
-        doc = Document(tenant_id=tenant_id, filename=file.filename, content=text[:10000])
+        doc = Document(tenant_id=tenant_id, filename=file.filename, content=text[:10000], content_hash=content_hash)
         session.add(doc)
         await session.flush()
+        session.add(make_document_text(doc.id, text))
+        session.add(DocumentVersion(
+            document_id=doc.id, version=1, filename=file.filename, content_hash=content_hash,
+            chunks=len(chunks), embedded=len(chunks),
+        ))
 
         # Сохраняем эмбеддинг как список чисел, без обёртки {"v": ...}
+        rows = []
         for i, (t, e) in enumerate(zip(chunks, embeddings), start=1):
-            c = Chunk(document_id=doc.id, tenant_id=tenant_id, ordinal=i, text=t, embedding=e)
+            c = Chunk(
+                id=uuid.uuid4(), document_id=doc.id, tenant_id=tenant_id, ordinal=i, text=t, embedding=e,
+                content_hash=text_hash(t), embed_model=embed_id(),
+            )
             session.add(c)
+            rows.append(c)
+        await session.flush()
+        session.add_all(positions(doc.id, 1, [c.id for c in rows]))
+
+        await session.commit()
+
+    await _append_to_store(tenant_id, [(c.id, c.document_id, c.ordinal) for c in rows], embeddings)
+
+    # Анализ по умолчанию считается после ответа клиенту, чтобы /analyze/contract отдал его из кэша
+    if precompute_analysis is None:
+        precompute_analysis = settings.ANALYZE_PRECOMPUTE_ON_UPLOAD
+    if precompute_analysis:
+        background_tasks.add_task(precompute_default_analysis, tenant_id, doc.id, 1)
+    return UploadResponse(document_id=doc.id, chunks=len(chunks))
+
+
+@router.post("/documents/{document_id}/versions", response_model=VersionUploadResponse)
+async def upload_document_version(
+    document_id: UUID,
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    tenant_id: str = Form(...),
+    precompute_analysis: Optional[bool] = Form(None),
+):
+    """Новая ревизия существующего документа: эмбеддятся и пишутся только изменённые чанки."""
+    if file.size is not None and file.size > settings.UPLOAD_MAX_BYTES:
+        raise HTTPException(413, f"File is too large. Maximum size is {settings.UPLOAD_MAX_BYTES} bytes.")
+    content_hash = await _hash_upload(file)
+
+    if SKIP_DB:
+        raise HTTPException(503, "Database is disabled. Set SKIP_DB=false to enable.")
+
+    SessionLocal = get_session_local()
+    if SessionLocal is None:
+        raise HTTPException(503, "Database connection is not available.")
+
+    async def current(session: AsyncSession, lock: bool = False):
+        stmt = select(Document).where(Document.id == document_id, Document.tenant_id == tenant_id)
+        doc = (await session.execute(stmt.with_for_update() if lock else stmt)).scalar_one_or_none()
+        if doc is None:
+            raise HTTPException(404, "Document not found")
+        if doc.content_hash == content_hash:
+            n = (await session.execute(
+                select(func.count(Chunk.id)).where(Chunk.document_id == doc.id, Chunk.version_to.is_(None))
+            )).scalar_one()
+            return doc, VersionUploadResponse(document_id=doc.id, version=doc.version, chunks=n, duplicate=True)
+        return doc, None
+
+    async with SessionLocal() as session:  # type: AsyncSession
+        _, duplicate = await current(session)
+    if duplicate is not None:
+        await _refresh_duplicate(SessionLocal, tenant_id, document_id)
+        return duplicate
+
+    # Извлечение, чанкинг и эмбеддинги — без транзакции и блокировки строки документа
+    text = await extract_text(file.filename, file.file)
+    if not text or len(text.strip()) == 0:
+        raise HTTPException(400, "Empty text after extraction")
+    chunks = chunk_text(text, target_tokens=300)
+    async with SessionLocal() as session:  # type: AsyncSession
+        pending = await pending_chunks(session, document_id, chunks)
+    embedded = await embed_pending(chunks, pending)
 
+    async with SessionLocal() as session:  # type: AsyncSession
+        # Под блокировкой план строится заново: параллельная ревизия не потеряется
+        doc, duplicate = await current(session, lock=True)
+        if duplicate is not None:
+            return duplicate
+        ver, rows, embeddings = await add_version(
+            session, doc, text, file.filename, content_hash, chunks, embedded
+        )
         await session.commit()
-        return UploadResponse(document_id=doc.id, chunks=len(chunks))
+
+    await _append_to_store(tenant_id, [(c.id, c.document_id, c.ordinal) for c in rows], embeddings)
+
+    if precompute_analysis is None:
+        precompute_analysis = settings.ANALYZE_PRECOMPUTE_ON_UPLOAD
+    if precompute_analysis:
+        background_tasks.add_task(precompute_default_analysis, tenant_id, document_id, ver.version)
+    return VersionUploadResponse(
+        document_id=document_id, version=ver.version, chunks=ver.chunks,
+        embedded=ver.embedded, reused=ver.reused, removed=ver.removed,
+    )
+
+
+@router.get("/documents/{document_id}/versions", response_model=List[DocumentVersionInfo])
+async def list_document_versions(document_id: UUID, tenant_id: str):
+    if SKIP_DB:
+        raise HTTPException(503, "Database is disabled. Set SKIP_DB=false to enable.")
+
+    SessionLocal = get_session_local()
+    if SessionLocal is None:
+        raise HTTPException(503, "Database connection is not available.")
+
+    async with SessionLocal() as session:  # type: AsyncSession
+        res = await session.execute(
+            select(DocumentVersion)
+            .join(Document, Document.id == DocumentVersion.document_id)
+            .where(DocumentVersion.document_id == document_id, Document.tenant_id == tenant_id)
+            .order_by(DocumentVersion.version)
+        )
+        versions = list(res.scalars())
+        if not versions:
+            raise HTTPException(404, "Document not found")
+        return [DocumentVersionInfo.model_validate(v, from_attributes=True) for v in versions]
+
+
+def _session_local():
+    if SKIP_DB:
+        raise HTTPException(503, "Database is disabled. Set SKIP_DB=false to enable.")
+    SessionLocal = get_session_local()
+    if SessionLocal is None:
+        raise HTTPException(503, "Database connection is not available.")
+    return SessionLocal
+
+
+# Списки и чтение выбирают только нужные колонки: JSONB-эмбеддинги и полный текст не грузятся
+
+@router.get("/documents", response_model=DocumentPage)
+async def list_documents(
+    tenant_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+):
+    """Документы тенанта, новые первыми; keyset-пагинация по (created_at, id)."""
+    stmt = (
+        select(Document.id, Document.filename, Document.version, Document.created_at)
+        .where(Document.tenant_id == tenant_id)
+        .order_by(Document.created_at.desc(), Document.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        try:
+            c_at, c_id = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(400, "Invalid cursor")
+        stmt = stmt.where(tuple_(Document.created_at, Document.id) < tuple_(c_at, c_id))
+
+    async with _session_local()() as session:  # type: AsyncSession
+        rows = (await session.execute(stmt)).all()
+
+    items = [DocumentSummary(id=r.id, filename=r.filename, version=r.version, created_at=r.created_at) for r in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+    return DocumentPage(items=items, next_cursor=next_cursor)
+
+
+@router.get("/documents/{document_id}", response_model=DocumentDetail)
+async def get_document(document_id: UUID, tenant_id: str, preview_chars: int = Query(500, ge=0, le=10000)):
+    chunk_count = (
+        select(func.count(Chunk.id))
+        .where(Chunk.document_id == Document.id, Chunk.version_to.is_(None))
+        .scalar_subquery()
+    )
+    stmt = select(
+        Document.id, Document.filename, Document.version, Document.created_at, Document.content_hash,
+        func.substr(Document.content, 1, preview_chars).label("preview"),
+        chunk_count.label("chunks"),
+    ).where(Document.id == document_id, Document.tenant_id == tenant_id)
+
+    async with _session_local()() as session:  # type: AsyncSession
+        row = (await session.execute(stmt)).first()
+    if row is None:
+        raise HTTPException(404, "Document not found")
+    return DocumentDetail(**row._mapping)
+
+
+async def _require_document(session: AsyncSession, document_id: UUID, tenant_id: str) -> None:
+    found = (await session.execute(
+        select(Document.id).where(Document.id == document_id, Document.tenant_id == tenant_id)
+    )).scalar_one_or_none()
+    if found is None:
+        raise HTTPException(404, "Document not found")
+
+
+@router.get("/documents/{document_id}/chunks", response_model=ChunkPage)
+async def list_chunks(
+    document_id: UUID,
+    tenant_id: str,
+    version: Optional[int] = None,
+    after_ordinal: int = 0,
+    limit: int = Query(100, ge=1, le=500),
+):
+    """Чанки версии документа (по умолчанию текущей) по возрастанию ordinal."""
+    stmt, position = chunks_in_version(version, Chunk.id, Chunk.text)
+    stmt = (
+        stmt.add_columns(position.label("ordinal"))
+        .where(Chunk.document_id == document_id, Chunk.tenant_id == tenant_id, position > after_ordinal)
+        .order_by(position)
+        .limit(limit + 1)
+    )
+    async with _session_local()() as session:  # type: AsyncSession
+        await _require_document(session, document_id, tenant_id)
+        rows = (await session.execute(stmt)).all()
+
+    items = [ChunkOut(id=r.id, ordinal=r.ordinal, text=r.text) for r in rows[:limit]]
+    next_cursor = items[-1].ordinal if len(rows) > limit else None
+    return ChunkPage(items=items, next_cursor=next_cursor)
+
+
+@router.get("/documents/{document_id}/text")
+async def stream_document_text(
+    document_id: UUID, tenant_id: str, version: Optional[int] = None, original: bool = False,
+):
+    """Текст чанков по порядку ordinal, потоком (серверный курсор, без загрузки всего документа).
+
+    ``original=true`` — исходный извлечённый текст версии из document_texts, без разбиения на чанки.
+    """
+    SessionLocal = _session_local()
+    async with SessionLocal() as session:  # type: AsyncSession
+        await _require_document(session, document_id, tenant_id)
+        if original:
+            text = await load_full_text(session, document_id, version)
+            if text is None:
+                raise HTTPException(404, "Original text is not stored for this document version")
+            return PlainTextResponse(text)
+
+    stmt, position = chunks_in_version(version, Chunk.text)
+    stmt = (
+        stmt.where(Chunk.document_id == document_id, Chunk.tenant_id == tenant_id)
+        .order_by(position)
+        .execution_options(yield_per=100)
+    )
+
+    async def body():
+        async with SessionLocal() as session:  # type: AsyncSession
+            result = await session.stream_scalars(stmt)
+            first = True
+            async for text in result:
+                yield ("" if first else "\n\n") + text
+                first = False
+
+    return StreamingResponse(body(), media_type="text/plain; charset=utf-8")
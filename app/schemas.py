@@ -2,14 +2,60 @@
 from pydantic import BaseModel, Field
 from typing import Any, List, Optional
 from uuid import UUID
+from datetime import datetime
 
 class UploadResponse(BaseModel):
     document_id: UUID
     chunks: int
+    duplicate: bool = False
+
+class VersionUploadResponse(BaseModel):
+    document_id: UUID
+    version: int
+    chunks: int
+    embedded: int = 0
+    reused: int = 0
+    removed: int = 0
+    duplicate: bool = False
+
+class DocumentVersionInfo(BaseModel):
+    version: int
+    filename: str
+    content_hash: str
+    chunks: int
+    embedded: int
+    reused: int
+    removed: int
+    created_at: Optional[datetime] = None
+
+class DocumentSummary(BaseModel):
+    id: UUID
+    filename: str
+    version: int
+    created_at: Optional[datetime] = None
+
+class DocumentPage(BaseModel):
+    items: List[DocumentSummary]
+    next_cursor: Optional[str] = None
+
+class DocumentDetail(DocumentSummary):
+    content_hash: Optional[str] = None
+    chunks: int
+    preview: str
+
+class ChunkOut(BaseModel):
+    id: UUID
+    ordinal: int
+    text: str
+
+class ChunkPage(BaseModel):
+    items: List[ChunkOut]
+    next_cursor: Optional[int] = None  # pass as after_ordinal
 
 class AnalyzeRequest(BaseModel):
     tenant_id: str
     document_id: Optional[UUID] = None
+    version: Optional[int] = None  # revision of document_id; latest by default
     text: Optional[str] = None
     query: str = "Сделай резюме документа и найди риски."
 
@@ -37,4 +83,5 @@ class AnalyzeResponse(BaseModel):
     citations: List[Citation]
     model: str
     sources: List[Source] = Field(default_factory=list)
+    cached: bool = False
     disclaimer: str = Field(default="Информационный сервис. Не юридическая консультация.")
@@ -0,0 +1,105 @@
+"""Кэш готовых ответов /v1/analyze/contract.
+
+Ключ: (document_id, версия документа, нормализованный запрос, маршрут LLM, версия промпта). Строки удаляются
+каскадом вместе с документом, а смена SYSTEM/USER_TEMPLATE меняет prompt_version,
+так что старые записи просто перестают совпадать. Модель, которая фактически ответила
+(роутер мог уйти на запасную), хранится в ``model_used``.
+"""
+import hashlib
+import logging
+import re
+from typing import Optional
+from uuid import UUID
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..db import get_session_local
+from ..models import AnalysisCache
+from ..schemas import AnalyzeRequest, AnalyzeResponse
+from .embedding import embed_id
+from .llm import LLMConfigurationError, _targets
+from .rag import SYSTEM, USER_TEMPLATE, build_prompt_and_citations, build_response, call_llm
+
+logger = logging.getLogger(__name__)
+
+PROMPT_VERSION = hashlib.sha256((SYSTEM + "\0" + USER_TEMPLATE).encode("utf-8")).hexdigest()[:16]
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", (query or "").strip().lower())
+
+
+def query_hash(query: str) -> str:
+    return hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()
+
+
+def model_key() -> str:
+    """Маршрут LLM (все цели по порядку) и провайдер эмбеддингов — ответы разных конфигураций
+    не смешиваются. Какая из целей ответила, заранее неизвестно, поэтому ключ — весь маршрут."""
+    try:
+        route = ",".join(f"{p}:{m}" for p, m in _targets(None, None))
+    except LLMConfigurationError:
+        route = (settings.LLM_PROVIDER or "perplexity").lower()
+    return f"{hashlib.sha256(route.encode('utf-8')).hexdigest()[:16]}|{embed_id()}"
+
+
+async def get_cached(
+    session: AsyncSession, tenant_id: str, document_id: UUID, version: int, query: str
+) -> Optional[AnalyzeResponse]:
+    res = await session.execute(
+        select(AnalysisCache.response).where(
+            AnalysisCache.document_id == document_id,
+            AnalysisCache.document_version == version,
+            AnalysisCache.tenant_id == tenant_id,
+            AnalysisCache.query_hash == query_hash(query),
+            AnalysisCache.model == model_key(),
+            AnalysisCache.prompt_version == PROMPT_VERSION,
+        )
+    )
+    raw = res.scalar_one_or_none()
+    if raw is None:
+        return None
+    resp = AnalyzeResponse.model_validate(raw)
+    resp.cached = True
+    return resp
+
+
+async def store(
+    session: AsyncSession, tenant_id: str, document_id: UUID, version: int, query: str, resp: AnalyzeResponse
+) -> None:
+    values = {
+        "document_id": document_id,
+        "document_version": version,
+        "tenant_id": tenant_id,
+        "query_hash": query_hash(query),
+        "model": model_key(),
+        "prompt_version": PROMPT_VERSION,
+        "model_used": resp.model,
+        "response": resp.model_dump(mode="json", exclude={"cached"}),
+    }
+    stmt = insert(AnalysisCache).values(**values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["document_id", "document_version", "query_hash", "model", "prompt_version"],
+        set_={"response": stmt.excluded.response, "model_used": stmt.excluded.model_used},
+    )
+    await session.execute(stmt)
+
+
+async def precompute_default_analysis(tenant_id: str, document_id: UUID, version: int = 1) -> None:
+    """Фоновая задача после загрузки: посчитать анализ для запроса по умолчанию."""
+    SessionLocal = get_session_local()
+    if SessionLocal is None:
+        return
+    req = AnalyzeRequest(tenant_id=tenant_id, document_id=document_id, version=version)
+    try:
+        async with SessionLocal() as session:  # type: AsyncSession
+            prompt, cits = await build_prompt_and_citations(session, req)
+            llm_out = await call_llm(prompt)
+            await store(session, tenant_id, document_id, version, req.query, build_response(llm_out, req.query, cits))
+            await session.commit()
+    except Exception:
+        # Фоновая задача не должна ронять воркер: при промахе анализ посчитается по запросу
+        logger.exception("Default analysis precompute failed for document %s", document_id)
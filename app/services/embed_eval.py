@@ -0,0 +1,128 @@
+"""Оценка recall@k компактного хранилища эмбеддингов относительно полной точности.
+
+    python -m app.services.embed_eval <tenant_id> [--k 6] [--sample 200] [--dtype int8] [--dim 256]
+
+Запросами служат эмбеддинги случайных чанков тенанта (или тексты из ``--query``); сам чанк-запрос
+исключается и из эталона, и из кандидатов, иначе он всегда был бы своим top-1.
+Эталон — точный косинус по полным векторам из Postgres; сравниваются отбор только по
+компактному представлению и отбор с точным пересчётом top ``k * EMBED_RESCORE_FACTOR``.
+"""
+import argparse
+import asyncio
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from sqlalchemy import select
+
+from ..config import settings
+from ..db import get_session_local
+from ..models import Chunk
+from .embedding import embed_texts
+from .vector_store import encode, prepare_query, score
+from .versioning import same_embedding
+
+
+def _normalize(mat: np.ndarray) -> np.ndarray:
+    return mat / np.maximum(np.linalg.norm(mat, axis=1, keepdims=True), 1e-8)
+
+
+def evaluate(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    k: int,
+    dtype: str,
+    dim: int,
+    rescore_factor: int,
+    query_rows: Optional[Sequence[int]] = None,
+) -> Dict[str, float]:
+    """recall@k компактного поиска (с пересчётом и без) против точного поиска по ``vectors``.
+
+    ``query_rows`` — строки ``vectors``, из которых взяты запросы; они исключаются из выдачи.
+    """
+    full = _normalize(vectors.astype(np.float32))
+    codes, scales = encode(vectors, dtype, dim)
+    pool = len(full) - (1 if query_rows is not None else 0)
+    k = min(k, pool)
+    n_cand = min(pool, k * max(1, rescore_factor))
+
+    hits_compact = hits_rescored = 0
+    for i, raw in enumerate(queries):
+        q_full = raw / max(float(np.linalg.norm(raw)), 1e-8)
+        exact_scores = full @ q_full
+        approx = score(codes, scales, prepare_query(raw, dim))
+        if query_rows is not None:
+            exact_scores[query_rows[i]] = -np.inf
+            approx[query_rows[i]] = -np.inf
+        exact = set(np.argsort(-exact_scores)[:k].tolist())
+
+        cand = np.argsort(-approx)[:n_cand]
+        hits_compact += len(exact & set(cand[:k].tolist()))
+        rescored = cand[np.argsort(-(full[cand] @ q_full))[:k]]
+        hits_rescored += len(exact & set(rescored.tolist()))
+
+    total = max(1, k * len(queries))
+    bytes_full = vectors.shape[1] * 4
+    bytes_compact = dim * np.dtype(dtype).itemsize + (4 if dtype == "int8" else 0)
+    return {
+        "vectors": float(len(full)),
+        "queries": float(len(queries)),
+        "recall_compact": hits_compact / total,
+        "recall_rescored": hits_rescored / total,
+        "bytes_per_vector_full": float(bytes_full),
+        "bytes_per_vector_compact": float(bytes_compact),
+        "compression": bytes_full / bytes_compact,
+    }
+
+
+async def _load(tenant_id: str) -> np.ndarray:
+    SessionLocal = get_session_local()
+    if SessionLocal is None:
+        raise SystemExit("Database is disabled")
+    async with SessionLocal() as session:
+        res = await session.execute(select(Chunk.embedding).where(Chunk.tenant_id == tenant_id, same_embedding()))
+        raw: List[List[float]] = []
+        for (emb,) in res.all():
+            if isinstance(emb, dict):
+                emb = emb.get("v", [])
+            if emb:
+                raw.append(emb)
+    if not raw:
+        raise SystemExit(f"No embeddings for tenant {tenant_id}")
+    width = max(set(len(e) for e in raw), key=[len(e) for e in raw].count)
+    return np.asarray([e for e in raw if len(e) == width], dtype=np.float32)
+
+
+async def _main(args: argparse.Namespace) -> None:
+    vectors = await _load(args.tenant_id)
+    query_rows = None
+    if args.query:
+        queries = np.asarray(await embed_texts(args.query), dtype=np.float32)
+        if queries.shape[1] != vectors.shape[1]:
+            raise SystemExit(
+                f"Query embeddings have {queries.shape[1]} dims but stored vectors have {vectors.shape[1]}; "
+                "set EMBED_DIM/LOCAL_EMBED_DIM to the width the tenant was embedded with"
+            )
+    else:
+        if len(vectors) < 2:
+            raise SystemExit(f"Need at least 2 embeddings for tenant {args.tenant_id}")
+        rng = np.random.default_rng(0)
+        query_rows = rng.choice(len(vectors), size=min(args.sample, len(vectors)), replace=False)
+        queries = vectors[query_rows]
+    dim: Optional[int] = args.dim or settings.EMBED_STORE_DIM
+    dim = dim if dim and 0 < dim < vectors.shape[1] else vectors.shape[1]
+    report = evaluate(vectors, queries, args.k, args.dtype, dim, args.rescore_factor, query_rows)
+    print(f"tenant={args.tenant_id} dtype={args.dtype} dim={dim}/{vectors.shape[1]} k={args.k}")
+    for key, value in report.items():
+        print(f"  {key}: {value:.4f}" if value < 10 else f"  {key}: {value:.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall@k of compact embeddings vs full precision")
+    parser.add_argument("tenant_id")
+    parser.add_argument("--k", type=int, default=6)
+    parser.add_argument("--sample", type=int, default=200)
+    parser.add_argument("--dtype", default=settings.EMBED_STORE_DTYPE, choices=["float32", "float16", "int8"])
+    parser.add_argument("--dim", type=int, default=0)
+    parser.add_argument("--rescore-factor", type=int, default=settings.EMBED_RESCORE_FACTOR)
+    parser.add_argument("--query", action="append", help="query text (repeatable); default: sampled chunks")
+    asyncio.run(_main(parser.parse_args()))
@@ -1,15 +1,145 @@
-from typing import List
-from openai import AsyncOpenAI
+"""Провайдеры эмбеддингов, выбираемые через ``EMBED_PROVIDER``.
+
+- ``openai`` — OpenAI Embeddings API (``OPENAI_EMBED_MODEL``, ``EMBED_DIM``);
+- ``local`` — встроенный CPU-векторизатор: хэшированные символьные n-граммы со
+  знаковым хэшированием и сублинейным TF, без сети и ключей.
+
+У каждого провайдера есть ``embed_id`` (провайдер, модель, размерность). Он пишется в
+``Chunk.embed_model`` и в manifest хранилища векторов, чтобы индексы разных
+провайдеров никогда не смешивались.
+"""
+import asyncio
+import re
+from typing import TYPE_CHECKING, List, Optional
+
 from ..config import settings
 
-_client: AsyncOpenAI | None = None
-def get_client() -> AsyncOpenAI:
+if TYPE_CHECKING:
+    import numpy as np
+    from openai import AsyncOpenAI
+
+_client: "AsyncOpenAI | None" = None
+def get_client() -> "AsyncOpenAI":
     global _client
     if _client is None:
+        from openai import AsyncOpenAI  # lazy import: SDK тяжёлый, нужен только при первом запросе
         _client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
     return _client
 
+
+class OpenAIEmbeddings:
+    # Лимит API на число входов в одном запросе — с запасом
+    batch_size = 512
+
+    def __init__(self, model: str, dim: int):
+        self.model = model
+        # text-embedding-3-* поддерживают Matryoshka-усечение на стороне API
+        self.dimensions = dim if model.startswith("text-embedding-3") and dim > 0 else None
+        self.embed_id = f"openai:{model}:{self.dimensions or 'native'}"
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        client = get_client()
+        kwargs = {"dimensions": self.dimensions} if self.dimensions else {}
+        out: List[List[float]] = []
+        for start in range(0, len(texts), self.batch_size):
+            resp = await client.embeddings.create(
+                model=self.model, input=texts[start:start + self.batch_size], **kwargs
+            )
+            out.extend(d.embedding for d in resp.data)
+        return out
+
+
+# Частые служебные слова русского и казахского: в n-граммы не попадают
+_STOPWORDS = frozenset("""
+и в во не на с со по к ко о об от до из за для при без над под про у же ли бы то что как а но или да
+это этот эта эти тот та те его ее её их он она они мы вы я ты так также который которая которые
+және мен бен пен үшін да де та те бұл осы сол ол олар біз сіз мен не немесе туралы бойынша арқылы
+""".split())
+_NON_WORD = re.compile(r"[^0-9a-zа-яәғқңөұүһі]+")
+_P1 = 0x100000001B3  # FNV prime
+_MIX = 0x9E3779B97F4A7C15  # golden-ratio mix для распределения по корзинам
+
+
+class LocalHashEmbeddings:
+    """Хэшированный TF-вектор символьных n-грамм слов (с маркерами границ слова).
+
+    Символьные n-граммы устойчивы к падежным и агглютинативным окончаниям русского и
+    казахского. IDF не обучается: векторизатор без состояния, поэтому сохранённые векторы
+    не устаревают по мере роста корпуса; вместо IDF — стоп-слова и сублинейный TF.
+    Кодирование пакетное: n-граммы всех текстов пакета хэшируются одними NumPy-операциями.
+    """
+
+    def __init__(self, dim: int, ngram_min: int = 3, ngram_max: int = 5):
+        self.dim = dim
+        self.ngrams = range(ngram_min, ngram_max + 1)
+        self.embed_id = f"local-hash-v1:{ngram_min}-{ngram_max}:{dim}"
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        words = _NON_WORD.sub(" ", text.lower().replace("ё", "е")).split()
+        return " " + " ".join(w for w in words if w not in _STOPWORDS) + " "
+
+    def encode(self, texts: List[str]) -> "np.ndarray":
+        import numpy as np
+
+        n_docs = len(texts)
+        norm = [self.normalize(t) for t in texts]
+        codes = np.frombuffer("".join(norm).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        doc_of = np.repeat(np.arange(n_docs), [len(t) for t in norm])
+
+        flat_idx: List["np.ndarray"] = []
+        flat_w: List["np.ndarray"] = []
+        with np.errstate(over="ignore"):  # переполнение uint64 — часть хэша
+            for n in self.ngrams:
+                m = len(codes) - n + 1
+                if m <= 0:
+                    continue
+                h = np.full(m, 0xCBF29CE484222325, dtype=np.uint64)
+                for j in range(n):
+                    h = (h ^ codes[j:j + m]) * np.uint64(_P1)
+                # n-грамма не должна пересекать границу документов
+                same = doc_of[:m] == doc_of[n - 1:n - 1 + m]
+                h = h[same] * np.uint64(_MIX)
+                bucket = (h >> np.uint64(32)) % np.uint64(self.dim)
+                sign = np.where((h >> np.uint64(31)) & np.uint64(1), 1.0, -1.0)
+                flat_idx.append(doc_of[:m][same] * self.dim + bucket.astype(np.int64))
+                flat_w.append(sign)
+
+        if flat_idx:
+            idx = np.concatenate(flat_idx)
+            w = np.concatenate(flat_w)
+            mat = np.bincount(idx, weights=w, minlength=n_docs * self.dim).reshape(n_docs, self.dim)
+        else:
+            mat = np.zeros((n_docs, self.dim))
+        mat = np.sign(mat) * np.log1p(np.abs(mat))  # сублинейный TF
+        mat /= np.maximum(np.linalg.norm(mat, axis=1, keepdims=True), 1e-8)
+        return mat.astype(np.float32)
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        # CPU-работа — вне event loop
+        return (await asyncio.to_thread(self.encode, texts)).tolist()
+
+
+_provider: Optional[object] = None
+def get_provider():
+    """Текущий провайдер эмбеддингов по EMBED_PROVIDER."""
+    global _provider
+    if _provider is None:
+        name = (settings.EMBED_PROVIDER or "openai").lower()
+        if name == "local":
+            _provider = LocalHashEmbeddings(settings.LOCAL_EMBED_DIM)
+        elif name == "openai":
+            _provider = OpenAIEmbeddings(settings.OPENAI_EMBED_MODEL, settings.EMBED_DIM)
+        else:
+            raise ValueError(f"Unknown EMBED_PROVIDER: {settings.EMBED_PROVIDER}")
+    return _provider
+
+
+def embed_id() -> str:
+    return get_provider().embed_id
+
+
 async def embed_texts(chunks: List[str]) -> List[List[float]]:
-    client = get_client()
-    resp = await client.embeddings.create(model=settings.OPENAI_EMBED_MODEL, input=chunks)
-    return [d.embedding for d in resp.data]
+    return await get_provider().embed(chunks)
@@ -1,18 +1,31 @@
 
 import io
-from pdfminer.high_level import extract_text as pdf_extract
-from docx import Document as DocxDocument
-import chardet
+from typing import BinaryIO, Union
 
-async def extract_text(filename: str, content: bytes) -> str:
+_DETECT_BYTES = 256 * 1024
+
+async def extract_text(filename: str, content: Union[bytes, BinaryIO]) -> str:
+    """Извлечь текст из байтов или файлового объекта (например, спула загрузки на диске)."""
+    fh = io.BytesIO(content) if isinstance(content, (bytes, bytearray)) else content
+    fh.seek(0)
     name = filename.lower()
+    # Парсеры импортируются при первом использовании, чтобы не замедлять холодный старт
     if name.endswith(".pdf"):
-        return pdf_extract(io.BytesIO(content))
+        from pdfminer.high_level import extract_text as pdf_extract
+        return pdf_extract(fh)
     if name.endswith(".docx"):
-        doc = DocxDocument(io.BytesIO(content))
+        from docx import Document as DocxDocument
+        doc = DocxDocument(fh)
         return "\n".join(p.text for p in doc.paragraphs)
-    enc = chardet.detect(content).get("encoding") or "utf-8"
+    import chardet
+    # Кодировку определяем по началу файла, декодируем потоково
+    enc = chardet.detect(fh.read(_DETECT_BYTES)).get("encoding") or "utf-8"
+    fh.seek(0)
+    try:
+        reader = io.TextIOWrapper(fh, encoding=enc, errors="ignore")
+    except LookupError:
+        reader = io.TextIOWrapper(fh, encoding="utf-8", errors="ignore")
     try:
-        return content.decode(enc, errors="ignore")
-    except Exception:
-        return content.decode("utf-8", errors="ignore")
+        return reader.read()
+    finally:
+        reader.detach()  # не закрывать исходный файл вместе с обёрткой
@@ -1,9 +1,15 @@
+import asyncio
 import json
-from typing import Any, Dict, List, Tuple
-
-import httpx
+import time
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, List, Tuple
 
 from ..config import settings
+from .llm_router import (
+    DeadlineExceeded, RequestRejected, Target, TargetUnavailable, get_breaker, get_latency, hedged_call,
+)
+
+if TYPE_CHECKING:
+    import httpx
 
 
 PERPLEXITY_BASE_URL = "https://api.perplexity.ai"
@@ -19,22 +25,53 @@ class LLMServiceError(Exception):
     pass
 
 
-async def _pplx_chat(
-    messages: List[Dict[str, str]],
-    temperature: float = 0.2,
-    force_model: str | None = None,
-    cheap_first: bool | None = None,
-) -> Tuple[str, str]:
-    if not settings.PERPLEXITY_API_KEY:
-        raise LLMConfigurationError(
-            "PERPLEXITY_API_KEY is not set. Please configure PERPLEXITY_API_KEY in environment variables."
-        )
-    
-    headers = {
-        "Authorization": f"Bearer {settings.PERPLEXITY_API_KEY}",
-        "Content-Type": "application/json",
-    }
+class LLMAuthError(LLMConfigurationError, RequestRejected):
+    """Провайдер отклонил API ключ (401/403) — повтор на других моделях бесполезен"""
+    pass
+
 
+class LLMRequestError(LLMServiceError, RequestRejected):
+    """Провайдер отклонил сам запрос (4xx) — повтор на других моделях бесполезен"""
+    pass
+
+
+def _status_error(provider: str, status: int, detail: Any) -> Exception:
+    """Исключение для HTTP-ошибки провайдера. 408/429 и 5xx — сбой цели (следующая цель, breaker),
+    остальные 4xx — ошибка запроса или ключа, маршрут прерывается."""
+    message = f"{provider} API error {status}: {detail}"
+    if status in (401, 403):
+        return LLMAuthError(message)
+    if 400 <= status < 500 and status not in (408, 429):
+        return LLMRequestError(message)
+    return LLMServiceError(message)
+
+
+_pplx_client: "httpx.AsyncClient | None" = None
+
+
+def get_pplx_client() -> "httpx.AsyncClient":
+    """Общий HTTP-клиент Perplexity: переиспользует соединения (и TLS) между запросами."""
+    global _pplx_client
+    if _pplx_client is None:
+        import httpx  # lazy import: заметная доля времени холодного старта
+        _pplx_client = httpx.AsyncClient(base_url=PERPLEXITY_BASE_URL, timeout=httpx.Timeout(60.0))
+    return _pplx_client
+
+
+def get_openai_client():
+    # Тот же клиент, что и для эмбеддингов: один пул соединений к OpenAI на процесс
+    from .embedding import get_client
+    return get_client()
+
+
+async def aclose_clients() -> None:
+    global _pplx_client
+    if _pplx_client is not None:
+        await _pplx_client.aclose()
+        _pplx_client = None
+
+
+def _pplx_models(force_model: str | None, cheap_first: bool | None) -> List[str]:
     # Build candidate list with cost-aware ordering.
     cheap_first = settings.LLM_PREFER_CHEAPEST if cheap_first is None else cheap_first
     configured = (settings.PERPLEXITY_MODEL or "").strip()
@@ -55,48 +92,134 @@ async def _pplx_chat(
     if force_model:
         # Force model goes first
         base = [force_model] + base
-    candidates = base
     # Preserve order and uniqueness
     seen = set()
-    models_to_try = [m for m in candidates if m and not (m in seen or seen.add(m))]
-
-    async with httpx.AsyncClient(base_url=PERPLEXITY_BASE_URL, timeout=httpx.Timeout(60.0)) as client:
-        last_detail = None
-        for model in models_to_try:
-            payload = {
-                "model": model,
-                "messages": messages,
-                "temperature": temperature,
-            }
-            resp = await client.post("/chat/completions", json=payload, headers=headers)
-            if resp.status_code == 400:
-                # Check if it's invalid_model and try next candidate
-                try:
-                    detail_json = resp.json()
-                except Exception:
-                    detail_json = {"text": resp.text}
-                err = detail_json.get("error", {}) if isinstance(detail_json, dict) else {}
-                if isinstance(err, dict) and err.get("type") == "invalid_model":
-                    last_detail = detail_json
-                    continue
-            try:
-                resp.raise_for_status()
-            except httpx.HTTPStatusError as e:
-                try:
-                    last_detail = resp.json()
-                except Exception:
-                    last_detail = {"text": resp.text}
-                raise LLMServiceError(
-                    f"Perplexity API error {resp.status_code}: {last_detail}"
-                ) from e
-            data = resp.json()
-            content = (data.get("choices", [{}])[0].get("message", {}) or {}).get("content", "") or ""
-            model_used = data.get("model") or model
-            return content, model_used
-
-    raise LLMServiceError(
-        f"Perplexity API invalid_model for all candidates: {models_to_try}. Last detail: {last_detail}"
-    )
+    return [m for m in base if m and not (m in seen or seen.add(m))]
+
+
+async def _pplx_call(
+    model: str,
+    messages: List[Dict[str, str]],
+    temperature: float,
+    timeout: float,
+) -> Tuple[str, str]:
+    import httpx
+
+    headers = {
+        "Authorization": f"Bearer {settings.PERPLEXITY_API_KEY}",
+        "Content-Type": "application/json",
+    }
+    payload = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+    }
+    try:
+        resp = await get_pplx_client().post(
+            "/chat/completions", json=payload, headers=headers, timeout=httpx.Timeout(timeout)
+        )
+    except httpx.HTTPError as e:
+        raise LLMServiceError(f"Perplexity API request failed: {e!r}") from e
+    if resp.status_code == 400:
+        # invalid_model — не ошибка сервиса, просто пробуем следующего кандидата
+        try:
+            detail_json = resp.json()
+        except Exception:
+            detail_json = {"text": resp.text}
+        err = detail_json.get("error", {}) if isinstance(detail_json, dict) else {}
+        if isinstance(err, dict) and err.get("type") == "invalid_model":
+            raise TargetUnavailable(f"Perplexity invalid_model {model}: {detail_json}")
+    try:
+        resp.raise_for_status()
+    except httpx.HTTPStatusError as e:
+        try:
+            detail = resp.json()
+        except Exception:
+            detail = {"text": resp.text}
+        raise _status_error("Perplexity", resp.status_code, detail) from e
+    data = resp.json()
+    content = (data.get("choices", [{}])[0].get("message", {}) or {}).get("content", "") or ""
+    model_used = data.get("model") or model
+    return content, model_used
+
+
+def _openai_error(e: Exception) -> Exception:
+    from openai import APIStatusError
+
+    if isinstance(e, APIStatusError):
+        return _status_error("OpenAI", e.status_code, e.message)
+    return LLMServiceError(f"OpenAI API error: {e!r}")
+
+
+async def _openai_call(
+    model: str,
+    messages: List[Dict[str, str]],
+    temperature: float,
+    timeout: float,
+) -> Tuple[str, str]:
+    try:
+        chat = await get_openai_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            timeout=timeout,
+        )
+    except Exception as e:
+        raise _openai_error(e) from e
+    text = chat.choices[0].message.content or ""
+    return text, model
+
+
+def _targets(force_model: str | None, cheap_first: bool | None) -> List[Target]:
+    """Упорядоченный список (provider, model): основной провайдер, затем LLM_FALLBACK_PROVIDERS.
+    Провайдеры без API-ключа пропускаются."""
+    primary = (settings.LLM_PROVIDER or "perplexity").lower()
+    fallbacks = [p.strip().lower() for p in (settings.LLM_FALLBACK_PROVIDERS or "").split(",") if p.strip()]
+    providers = [primary] + [p for p in fallbacks if p != primary]
+
+    targets: List[Target] = []
+    missing: List[str] = []
+    for provider in providers:
+        if provider == "perplexity":
+            if not settings.PERPLEXITY_API_KEY:
+                missing.append("PERPLEXITY_API_KEY")
+                continue
+            targets.extend(("perplexity", m) for m in _pplx_models(force_model, cheap_first))
+        elif provider == "openai":
+            if not settings.OPENAI_API_KEY:
+                missing.append("OPENAI_API_KEY")
+                continue
+            targets.append(("openai", settings.OPENAI_MODEL))
+    if not targets:
+        raise LLMConfigurationError(
+            f"No LLM provider is configured ({', '.join(missing) or 'LLM_PROVIDER'} is not set). "
+            "Please configure it in environment variables."
+        )
+    return targets
+
+
+async def _route(
+    messages: List[Dict[str, str]],
+    temperature: float,
+    force_model: str | None,
+    cheap_first: bool | None,
+    deadline: float | None,
+) -> Tuple[str, str]:
+    targets = _targets(force_model, cheap_first)
+
+    async def call(target: Target, timeout: float) -> Tuple[str, str]:
+        provider, model = target
+        if provider == "perplexity":
+            return await _pplx_call(model, messages, temperature, timeout)
+        return await _openai_call(model, messages, temperature, timeout)
+
+    budget = settings.LLM_DEADLINE_S if deadline is None else deadline
+    try:
+        return await hedged_call(targets, call, budget)
+    except LLMServiceError:
+        raise
+    except (TargetUnavailable, DeadlineExceeded) as e:
+        raise LLMServiceError(f"{e}. Targets: {targets}") from e
 
 
 async def chat_text(
@@ -106,28 +229,15 @@ async def chat_text(
     *,
     force_model: str | None = None,
     cheap_first: bool | None = None,
+    deadline: float | None = None,
 ) -> Tuple[str, str]:
-    """Return (text, model_used). Uses Perplexity when configured, fallback OpenAI otherwise."""
-    provider = (settings.LLM_PROVIDER or "perplexity").lower()
+    """Return (text, model_used). Routes across LLM_PROVIDER and LLM_FALLBACK_PROVIDERS
+    within the `deadline` budget (seconds, defaults to LLM_DEADLINE_S)."""
     messages = [
         {"role": "system", "content": system},
         {"role": "user", "content": user},
     ]
-
-    if provider == "perplexity":
-        return await _pplx_chat(messages, temperature=temperature, force_model=force_model, cheap_first=cheap_first)
-
-    # Fallback to OpenAI if explicitly requested
-    from openai import AsyncOpenAI  # lazy import
-    client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
-    chat = await client.chat.completions.create(
-        model=settings.OPENAI_MODEL,
-        messages=messages,
-        temperature=temperature,
-    )
-    text = chat.choices[0].message.content or ""
-    model_used = settings.OPENAI_MODEL
-    return text, model_used
+    return await _route(messages, temperature, force_model, cheap_first, deadline)
 
 
 async def chat_messages(
@@ -136,33 +246,13 @@ async def chat_messages(
     *,
     force_model: str | None = None,
     cheap_first: bool | None = None,
+    deadline: float | None = None,
 ) -> Tuple[str, str]:
     """Generic chat helper that preserves the provided conversation turns."""
     if not messages:
         raise ValueError("messages must be a non-empty list")
 
-    provider = (settings.LLM_PROVIDER or "perplexity").lower()
-
-    if provider == "perplexity":
-        return await _pplx_chat(
-            messages,
-            temperature=temperature,
-            force_model=force_model,
-            cheap_first=cheap_first,
-        )
-
-    # Fallback to OpenAI if explicitly requested
-    from openai import AsyncOpenAI  # lazy import
-
-    client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
-    chat = await client.chat.completions.create(
-        model=settings.OPENAI_MODEL,
-        messages=messages,
-        temperature=temperature,
-    )
-    text = chat.choices[0].message.content or ""
-    model_used = settings.OPENAI_MODEL
-    return text, model_used
+    return await _route(messages, temperature, force_model, cheap_first, deadline)
 
 
 async def chat_json(
@@ -172,11 +262,14 @@ async def chat_json(
     *,
     force_model: str | None = None,
     cheap_first: bool | None = None,
+    deadline: float | None = None,
 ) -> Tuple[Dict[str, Any], str]:
     """Best-effort JSON response. If model returns non-JSON, wrap it into a JSON object.
     Returns (data, model_used).
     """
-    text, model_used = await chat_text(system, user, temperature=temperature, force_model=force_model, cheap_first=cheap_first)
+    text, model_used = await chat_text(
+        system, user, temperature=temperature, force_model=force_model, cheap_first=cheap_first, deadline=deadline
+    )
     try:
         data = json.loads(text)
         if not isinstance(data, dict):
@@ -184,3 +277,162 @@ async def chat_json(
     except Exception:
         data = {"summary": text, "risks": [], "checklist": []}
     return data, model_used
+
+
+async def _pplx_stream(
+    model: str,
+    messages: List[Dict[str, str]],
+    temperature: float,
+    timeout: float,
+    json_schema: Dict[str, Any] | None,
+) -> AsyncIterator[str]:
+    import httpx
+
+    headers = {
+        "Authorization": f"Bearer {settings.PERPLEXITY_API_KEY}",
+        "Content-Type": "application/json",
+    }
+    payload: Dict[str, Any] = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "stream": True,
+    }
+    if json_schema:
+        payload["response_format"] = {"type": "json_schema", "json_schema": {"schema": json_schema}}
+    try:
+        async with get_pplx_client().stream(
+            "POST", "/chat/completions", json=payload, headers=headers, timeout=httpx.Timeout(timeout)
+        ) as resp:
+            if resp.status_code >= 400:
+                body = await resp.aread()
+                try:
+                    detail = json.loads(body)
+                except Exception:
+                    detail = {"text": body.decode("utf-8", errors="ignore")}
+                err = detail.get("error", {}) if isinstance(detail, dict) else {}
+                if resp.status_code == 400 and isinstance(err, dict) and err.get("type") == "invalid_model":
+                    raise TargetUnavailable(f"Perplexity invalid_model {model}: {detail}")
+                raise _status_error("Perplexity", resp.status_code, detail)
+            async for line in resp.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    chunk = json.loads(data)
+                    delta = (chunk.get("choices", [{}])[0].get("delta", {}) or {}).get("content")
+                except (ValueError, AttributeError, IndexError) as e:
+                    raise LLMServiceError(f"Perplexity stream returned malformed event: {data[:200]!r}") from e
+                if delta:
+                    yield delta
+    except httpx.HTTPError as e:
+        raise LLMServiceError(f"Perplexity API request failed: {e!r}") from e
+
+
+async def _openai_stream(
+    model: str,
+    messages: List[Dict[str, str]],
+    temperature: float,
+    timeout: float,
+    json_schema: Dict[str, Any] | None,
+) -> AsyncIterator[str]:
+    kwargs: Dict[str, Any] = {}
+    if json_schema:
+        kwargs["response_format"] = {"type": "json_object"}
+    try:
+        stream = await get_openai_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            timeout=timeout,
+            stream=True,
+            **kwargs,
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    except Exception as e:
+        raise _openai_error(e) from e
+
+
+async def chat_stream(
+    system: str,
+    user: str,
+    temperature: float = 0.2,
+    *,
+    json_schema: Dict[str, Any] | None = None,
+    cheap_first: bool | None = None,
+    deadline: float | None = None,
+) -> AsyncIterator[Tuple[str, str]]:
+    """Stream (model_used, text_delta). With `json_schema` the provider is asked for structured JSON.
+
+    Targets are tried in routing order (respecting circuit breakers) until one produces its
+    first token; after that the stream is committed to that target. No hedging here —
+    a duplicated stream would double the token cost for the whole answer.
+    """
+    messages = [
+        {"role": "system", "content": system},
+        {"role": "user", "content": user},
+    ]
+    targets = _targets(None, cheap_first)
+    loop = asyncio.get_running_loop()
+    t_end = loop.time() + (settings.LLM_DEADLINE_S if deadline is None else deadline)
+    last_error: Exception | None = None
+
+    for target in targets:
+        # Дедлайн — до allow(): иначе half-open проба осталась бы занятой без вызова
+        remaining = t_end - loop.time()
+        if remaining <= 0:
+            break
+        breaker = get_breaker(target)
+        if not breaker.allow():
+            continue
+        provider, model = target
+        stream_fn = _pplx_stream if provider == "perplexity" else _openai_stream
+        agen = stream_fn(model, messages, temperature, remaining, json_schema)
+        started = time.monotonic()
+        first = True
+        try:
+            while True:
+                remaining = t_end - loop.time()
+                if remaining <= 0:
+                    raise DeadlineExceeded("LLM stream deadline exceeded")
+                try:
+                    delta = await asyncio.wait_for(agen.__anext__(), timeout=remaining)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError as e:
+                    raise DeadlineExceeded("LLM stream deadline exceeded") from e
+                first = False
+                yield model, delta
+        except TargetUnavailable as e:
+            breaker.release()
+            last_error = e
+            continue
+        except RequestRejected:
+            breaker.release()
+            raise
+        except (LLMServiceError, DeadlineExceeded) as e:
+            breaker.record(False)
+            if not first:
+                raise LLMServiceError(f"LLM stream interrupted: {e}") from e
+            last_error = e
+            continue
+        except (GeneratorExit, asyncio.CancelledError):
+            # Клиент отключился — исход вызова неизвестен
+            breaker.release()
+            raise
+        except Exception:
+            # Любая другая ошибка — сбой цели; иначе half-open проба так и осталась бы занятой
+            breaker.record(False)
+            raise
+        finally:
+            await agen.aclose()
+        latency = time.monotonic() - started
+        get_latency(target).add(latency)
+        breaker.record(latency < settings.LLM_BREAKER_SLOW_CALL_S)
+        return
+
+    raise LLMServiceError(f"No LLM target produced a stream (last error: {last_error}). Targets: {targets}")
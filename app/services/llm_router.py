@@ -0,0 +1,237 @@
+"""Маршрутизация запросов к LLM: дедлайны, hedged-запросы и circuit breaker'ы.
+
+Модуль ничего не знает о конкретных провайдерах: ему передают упорядоченный
+список целей ``(provider, model)`` и корутину-вызов. Состояние breaker'ов и
+статистика задержек хранятся в памяти процесса (на каждый uvicorn worker своё).
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+from ..config import settings
+
+T = TypeVar("T")
+Target = Tuple[str, str]  # (provider, model)
+
+
+class TargetUnavailable(Exception):
+    """Цель не может обслужить запрос (например, invalid_model) — пробуем следующую,
+    не засчитывая ошибку в breaker."""
+    pass
+
+
+class RequestRejected(Exception):
+    """Запрос отклонён так, что другие цели не помогут (неверный ключ, 4xx на сам запрос):
+    маршрут прерывается сразу, ошибка не засчитывается в breaker."""
+    pass
+
+
+class DeadlineExceeded(Exception):
+    """Бюджет времени на запрос исчерпан."""
+    pass
+
+
+class CircuitBreaker:
+    """Скользящее окно исходов: closed → open при высокой доле ошибок/медленных
+    ответов, open → half-open после cooldown (один пробный запрос)."""
+
+    def __init__(self, window: int, min_calls: int, error_rate: float, cooldown_s: float):
+        self.window: Deque[bool] = deque(maxlen=window)
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.cooldown_s = cooldown_s
+        self.state = "closed"
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown_s:
+            self.state = "half_open"
+            self._probe_in_flight = False
+        if self.state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def release(self) -> None:
+        """Пробный вызов завершился без исхода (отменён/пропущен) — разрешить новую пробу."""
+        self._probe_in_flight = False
+
+    def record(self, ok: bool) -> None:
+        if self.state == "half_open":
+            self._probe_in_flight = False
+            if ok:
+                self.state = "closed"
+                self.window.clear()
+            else:
+                self._trip()
+            return
+        self.window.append(ok)
+        if len(self.window) >= self.min_calls:
+            failures = sum(1 for x in self.window if not x)
+            if failures / len(self.window) >= self.error_rate:
+                self._trip()
+
+    def _trip(self) -> None:
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.window.clear()
+
+
+class LatencyTracker:
+    """Последние N задержек успешных вызовов; p95 используется как задержка хеджирования."""
+
+    def __init__(self, size: int = 100):
+        self.samples: Deque[float] = deque(maxlen=size)
+
+    def add(self, latency_s: float) -> None:
+        self.samples.append(latency_s)
+
+    def p95(self) -> Optional[float]:
+        if len(self.samples) < 10:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+_breakers: Dict[Target, CircuitBreaker] = {}
+_latencies: Dict[Target, LatencyTracker] = {}
+
+
+def get_breaker(target: Target) -> CircuitBreaker:
+    br = _breakers.get(target)
+    if br is None:
+        br = CircuitBreaker(
+            window=settings.LLM_BREAKER_WINDOW,
+            min_calls=settings.LLM_BREAKER_MIN_CALLS,
+            error_rate=settings.LLM_BREAKER_ERROR_RATE,
+            cooldown_s=settings.LLM_BREAKER_COOLDOWN_S,
+        )
+        _breakers[target] = br
+    return br
+
+
+def get_latency(target: Target) -> LatencyTracker:
+    tr = _latencies.get(target)
+    if tr is None:
+        tr = LatencyTracker()
+        _latencies[target] = tr
+    return tr
+
+
+def hedge_delay(target: Target) -> float:
+    p95 = get_latency(target).p95()
+    if p95 is None:
+        return settings.LLM_HEDGE_DELAY_S
+    return max(settings.LLM_HEDGE_MIN_DELAY_S, p95)
+
+
+def breaker_snapshot() -> Dict[str, Dict[str, object]]:
+    """Состояние breaker'ов и p95 по целям (для /ready и диагностики)."""
+    out: Dict[str, Dict[str, object]] = {}
+    for target, br in _breakers.items():
+        out[f"{target[0]}:{target[1]}"] = {"state": br.state, "p95": get_latency(target).p95()}
+    return out
+
+
+async def _observed(target: Target, call: Callable[[Target, float], Awaitable[T]], timeout: float) -> T:
+    started = time.monotonic()
+    try:
+        result = await call(target, timeout)
+    except (TargetUnavailable, RequestRejected, asyncio.CancelledError):
+        get_breaker(target).release()
+        raise
+    except Exception:
+        get_breaker(target).record(False)
+        raise
+    latency = time.monotonic() - started
+    get_latency(target).add(latency)
+    get_breaker(target).record(latency < settings.LLM_BREAKER_SLOW_CALL_S)
+    return result
+
+
+async def hedged_call(
+    targets: List[Target],
+    call: Callable[[Target, float], Awaitable[T]],
+    deadline_s: float,
+) -> T:
+    """Вызвать первую доступную цель; если она не ответила за её p95 — запустить
+    следующую параллельно (hedge). При ошибке — переход к следующей цели.
+    Первый успешный ответ побеждает, остальные вызовы отменяются.
+
+    Бросает ``RequestRejected`` сразу, иначе последнюю ошибку цели или ``DeadlineExceeded``.
+    """
+    loop = asyncio.get_running_loop()
+    t_end = loop.time() + deadline_s
+    # allow() проверяется лениво, перед самым запуском: иначе half-open пробы
+    # «резервировались» бы для целей, до которых дело так и не дошло.
+    queue = list(targets)
+
+    pending: Dict["asyncio.Task[T]", Target] = {}
+    hedges_left = settings.LLM_HEDGE_MAX if settings.LLM_HEDGE_ENABLED else 0
+    last_error: Optional[BaseException] = None
+    next_hedge_at: Optional[float] = None
+
+    def launch() -> bool:
+        nonlocal next_hedge_at
+        while queue:
+            target = queue.pop(0)
+            if get_breaker(target).allow():
+                break
+        else:
+            return False
+        remaining = max(0.1, t_end - loop.time())
+        task = asyncio.ensure_future(_observed(target, call, remaining))
+        pending[task] = target
+        next_hedge_at = loop.time() + hedge_delay(target)
+        return True
+
+    if not launch():
+        raise TargetUnavailable(f"All LLM targets are circuit-open: {targets}")
+    try:
+        while pending:
+            now = loop.time()
+            if now >= t_end:
+                break
+            wait_until = t_end
+            can_hedge = hedges_left > 0 and bool(queue)
+            if can_hedge and next_hedge_at is not None:
+                wait_until = min(wait_until, next_hedge_at)
+            done, _ = await asyncio.wait(
+                pending.keys(), timeout=max(0.0, wait_until - now), return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                if can_hedge and loop.time() >= (next_hedge_at or t_end):
+                    hedges_left -= 1
+                    launch()
+                continue
+            unavailable = 0
+            for task in done:
+                pending.pop(task)
+                exc = task.exception()
+                if exc is None:
+                    return task.result()
+                if isinstance(exc, RequestRejected):
+                    raise exc
+                if isinstance(exc, TargetUnavailable):
+                    unavailable += 1
+                last_error = exc
+            # Недоступная цель (invalid_model и т.п.) не тратит hedge — её место сразу занимает следующая
+            for _ in range(unavailable):
+                launch()
+            # Все запущенные цели упали — переходим к следующей (fallback, не hedge)
+            if not pending and queue:
+                launch()
+    finally:
+        for task, target in pending.items():
+            task.cancel()
+            # Вызов не уложился в бюджет — считаем это ошибкой цели
+            if loop.time() >= t_end:
+                get_breaker(target).record(False)
+
+    if last_error is not None and loop.time() < t_end:
+        raise last_error
+    raise DeadlineExceeded(f"LLM deadline of {deadline_s:.1f}s exceeded (last error: {last_error})")
@@ -1,12 +1,21 @@
-from typing import List, Tuple, Dict, Any
+import json
+import logging
+from typing import TYPE_CHECKING, AsyncIterator, List, Optional, Tuple, Dict, Any
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import func
 from uuid import UUID
-import numpy as np
 from ..models import Chunk
 from ..config import settings
-from ..schemas import AnalyzeRequest
-from .llm import chat_json
+from ..schemas import AnalyzeRequest, AnalyzeResponse, Citation
+from .llm import chat_json, chat_stream
+from .risk_rules import rule_flags
+from .embedding import embed_texts
+from .versioning import chunks_in_version, same_embedding
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
 
 SYSTEM = (
     "Ты юридический ассистент для МСБ в Казахстане. "
@@ -24,7 +33,19 @@ USER_TEMPLATE = """Текст запроса: {query}
 Ответ в JSON с полями: summary, risks[], checklist[].
 """
 
-def _to_vec(raw) -> np.ndarray:
+# JSON Schema для structured output (стриминговый режим)
+ANALYSIS_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "summary": {"type": "string"},
+        "risks": {"type": "array", "items": {"type": "string"}},
+        "checklist": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["summary", "risks", "checklist"],
+}
+
+def _to_vec(raw) -> "np.ndarray":
+    import numpy as np  # lazy: не грузим NumPy при старте приложения
     # Совместимость со старым форматом {"v":[...]}
     if isinstance(raw, dict):
         raw = raw.get("v", [])
@@ -33,46 +54,120 @@ def _to_vec(raw) -> np.ndarray:
     # Приведение к float32
     return np.asarray([float(x) for x in raw], dtype=np.float32).reshape(-1)
 
-async def _top_chunks(session: AsyncSession, document_id: UUID, query: str, k: int = 6):
-    # Embeddings: keep using OpenAI embeddings as configured
-    from openai import AsyncOpenAI  # local import to avoid hard dependency when provider is Perplexity
-    _emb_client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
-    q_emb = (await _emb_client.embeddings.create(model=settings.OPENAI_EMBED_MODEL, input=[query])).data[0].embedding
-    q = _to_vec(q_emb)
-
-    res = await session.execute(
-        select(Chunk).where(Chunk.document_id == document_id)
-    )
-    rows: List[Chunk] = [r[0] for r in res.fetchall()]
-
-    scored: List[Tuple[float, Chunk]] = []
-    for ch in rows:
-        e = _to_vec(ch.embedding)
-        score = 0.0 if e.size == 0 else float(np.dot(q, e) / (np.linalg.norm(q) * np.linalg.norm(e) + 1e-8))
-        scored.append((score, ch))
+def _rank(q: "np.ndarray", rows: List[Tuple[Chunk, int]], k: int) -> List[Tuple[Chunk, int]]:
+    """Top-k пар (чанк, позиция в версии) по косинусу с запросом."""
+    import numpy as np
+    scored: List[Tuple[float, Tuple[Chunk, int]]] = []
+    mismatched = 0
+    for row in rows:
+        e = _to_vec(row[0].embedding)
+        if e.size != q.size:
+            mismatched += 1
+            scored.append((0.0, row))
+            continue
+        scored.append((float(np.dot(q, e) / (np.linalg.norm(q) * np.linalg.norm(e) + 1e-8)), row))
+    if mismatched:
+        logger.warning("%d chunk embeddings do not match query dim %d; they were scored 0", mismatched, q.size)
 
     scored.sort(key=lambda x: x[0], reverse=True)
     return [c for _, c in scored[:k]]
 
+async def _top_chunks(session: AsyncSession, tenant_id: str, document_id: UUID, query: str, k: int = 6, version: Optional[int] = None):
+    q = _to_vec((await embed_texts([query]))[0])
+
+    if settings.EMBED_STORE_ENABLED:
+        from . import vector_store
+        # Кандидаты по компактному представлению, затем точный пересчёт по полным векторам из БД
+        hits = vector_store.search(tenant_id, q, k * max(1, settings.EMBED_RESCORE_FACTOR), document_id=document_id)
+        if hits:
+            stmt, position = chunks_in_version(version, Chunk)
+            res = await session.execute(
+                stmt.add_columns(position).where(Chunk.id.in_([chunk_id for _, chunk_id in hits]), same_embedding())
+            )
+            rows = [tuple(r) for r in res.all()]
+            # Хранилище держит строки всех версий: кандидаты пересмотренного документа — часто
+            # почти дубликаты из прошлых ревизий. Если после фильтра по версии осталось меньше k,
+            # а у версии есть ещё чанки — точный проход по БД.
+            if len(rows) >= k:
+                return _rank(q, rows, k)
+            stmt, _ = chunks_in_version(version, func.count(Chunk.id))
+            active = (await session.execute(
+                stmt.where(Chunk.document_id == document_id, same_embedding())
+            )).scalar_one()
+            if rows and active <= len(rows):
+                return _rank(q, rows, k)
+
+    stmt, position = chunks_in_version(version, Chunk)
+    res = await session.execute(
+        stmt.add_columns(position).where(Chunk.document_id == document_id, same_embedding())
+    )
+    rows: List[Tuple[Chunk, int]] = [tuple(r) for r in res.all()]
+    return _rank(q, rows, k)
+
 async def build_prompt_and_citations(session: AsyncSession, req: AnalyzeRequest) -> Tuple[str, List[Dict[str, Any]]]:
     contexts: List[str] = []
     citations: List[Dict[str, Any]] = []
     if req.document_id:
-        rows = await _top_chunks(session, req.document_id, req.query, 6)
-        for r in rows:
-            contexts.append(f"[{r.ordinal}] {r.text[:800]}")
+        rows = await _top_chunks(session, req.tenant_id, req.document_id, req.query, 6, req.version)
+        for r, ordinal in rows:
+            contexts.append(f"[{ordinal}] {r.text[:800]}")
             citations.append({
-                "document_id": r.document_id, "chunk_id": r.id, "ordinal": r.ordinal,
+                "document_id": r.document_id, "chunk_id": r.id, "ordinal": ordinal,
                 "preview": r.text[:200]
             })
     else:
-        contexts = [req.text[:2000] if req.text else "нет контекста"]
+        return text_prompt(req), citations
 
     ctx = "\n\n".join(contexts) if contexts else "нет контекста"
     prompt = USER_TEMPLATE.format(query=req.query, contexts=ctx)
     return prompt, citations
 
+def text_prompt(req: AnalyzeRequest) -> str:
+    """Промпт по сырому тексту запроса, без обращения к БД."""
+    return USER_TEMPLATE.format(query=req.query, contexts=req.text[:2000] if req.text else "нет контекста")
+
 async def call_llm(prompt: str) -> Dict[str, Any]:
-    data, model_used = await chat_json(SYSTEM, prompt, temperature=0.2)
+    data, model_used = await chat_json(SYSTEM, prompt, temperature=0.2, deadline=settings.LLM_DEADLINE_ANALYZE_S)
     data["model"] = model_used
     return data
+
+async def stream_llm(prompt: str) -> AsyncIterator[Tuple[str, str]]:
+    """(model, delta) по мере генерации; модель просят вернуть JSON по ANALYSIS_SCHEMA."""
+    async for model, delta in chat_stream(
+        SYSTEM, prompt, temperature=0.2, json_schema=ANALYSIS_SCHEMA, deadline=settings.LLM_DEADLINE_ANALYZE_S
+    ):
+        yield model, delta
+
+def as_text(item: Any) -> str:
+    """Элемент risks/checklist как строка (модели иногда возвращают объекты)."""
+    if isinstance(item, str):
+        return item
+    if isinstance(item, dict):
+        for v in item.values():
+            if isinstance(v, str) and v.strip():
+                return v
+    return json.dumps(item, ensure_ascii=False)
+
+def as_items(value: Any) -> List[str]:
+    """Поле risks/checklist как список строк: null — пусто, одиночное значение — один элемент."""
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        value = [value]
+    return [as_text(v) for v in value if v is not None]
+
+def build_response(llm_out: Dict[str, Any], query: str, citations: List[Dict[str, Any]]) -> AnalyzeResponse:
+    # Модель не всегда соблюдает схему ({"summary": null}, строка вместо массива) — приводим типы
+    summary = llm_out.get("summary")
+    summary = "" if summary is None else as_text(summary)
+    risks = as_items(llm_out.get("risks"))
+    for flag in rule_flags(summary + " " + query):
+        if flag not in risks:
+            risks.append(flag)
+    return AnalyzeResponse(
+        summary=summary,
+        risks=risks,
+        checklist=as_items(llm_out.get("checklist")),
+        citations=[Citation(**c) for c in citations],
+        model=str(llm_out.get("model") or "unknown")
+    )
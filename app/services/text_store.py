@@ -0,0 +1,54 @@
+"""Полный извлечённый текст документа в сжатом виде (таблица document_texts).
+
+zstd используется, если установлен пакет ``zstandard``; иначе gzip. Кодек хранится
+в строке, поэтому данные читаются при любом наборе зависимостей, где он доступен.
+"""
+import gzip
+from typing import Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..models import DocumentText
+
+try:  # optional dependency
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+
+def compress_text(text: str) -> Tuple[str, bytes]:
+    raw = text.encode("utf-8")
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=6).compress(raw)
+    return "gzip", gzip.compress(raw, compresslevel=6)
+
+
+def decompress_text(codec: str, data: bytes) -> str:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd-compressed document text")
+        raw = zstandard.ZstdDecompressor().decompress(data)
+    elif codec == "gzip":
+        raw = gzip.decompress(data)
+    else:
+        raise ValueError(f"Unknown text codec: {codec}")
+    return raw.decode("utf-8")
+
+
+def make_document_text(document_id: UUID, text: str, version: int = 1) -> DocumentText:
+    codec, data = compress_text(text)
+    return DocumentText(document_id=document_id, version=version, codec=codec, size=len(text), data=data)
+
+
+async def load_full_text(session: AsyncSession, document_id: UUID, version: Optional[int] = None) -> Optional[str]:
+    """Полный текст версии ``version`` (None — последней сохранённой)."""
+    stmt = select(DocumentText.codec, DocumentText.data).where(DocumentText.document_id == document_id)
+    if version is not None:
+        stmt = stmt.where(DocumentText.version == version)
+    res = await session.execute(stmt.order_by(DocumentText.version.desc()).limit(1))
+    row = res.first()
+    if row is None:
+        return None
+    return decompress_text(row.codec, row.data)
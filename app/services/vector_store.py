@@ -0,0 +1,361 @@
+"""Memory-mapped хранилище эмбеддингов по тенантам.
+
+На диске для каждого тенанта::
+
+    {EMBED_STORE_DIR}/{tenant}/manifest.json    {"dim", "dtype", "count", "generation", "embed_model"}
+    {EMBED_STORE_DIR}/{tenant}/vectors.{gen}.bin сплошная матрица count×dim (float32/float16/int8)
+    {EMBED_STORE_DIR}/{tenant}/meta.{gen}.bin    chunk_id, document_id, ordinal, scale на строку
+
+Строки усечены до EMBED_STORE_DIM (Matryoshka), нормализованы и при int8 квантованы
+с масштабом на строку, поэтому скоринг — это ``(matrix @ q) * scale``. Это компактное
+представление для отбора кандидатов; точный пересчёт делает вызывающий код.
+Все uvicorn workers отображают одни и те же файлы read-only (np.memmap), так что
+страницы живут в page cache один раз на машину. Запись (append при загрузке,
+rebuild из Postgres) сериализуется через flock; читатели видят только ``count``
+строк из manifest, поэтому недописанный хвост файла им не виден.
+"""
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import re
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..models import Chunk
+from .embedding import embed_id
+from .versioning import same_embedding
+
+logger = logging.getLogger(__name__)
+
+META_DTYPE = np.dtype([("chunk_id", "V16"), ("document_id", "V16"), ("ordinal", "<i4"), ("scale", "<f4")])
+_BLOCK_ROWS = 65536
+
+# tenant -> (manifest mtime_ns, manifest, vectors memmap, meta memmap)
+_maps: Dict[str, Tuple[int, dict, np.ndarray, np.ndarray]] = {}
+
+
+def _tenant_dir(tenant_id: str) -> str:
+    safe = re.sub(r"[^A-Za-z0-9_.-]", "_", tenant_id) or "_"
+    return os.path.join(settings.EMBED_STORE_DIR, safe)
+
+
+def _manifest_path(tenant_id: str) -> str:
+    return os.path.join(_tenant_dir(tenant_id), "manifest.json")
+
+
+def _files(tenant_id: str, generation: int) -> Tuple[str, str]:
+    d = _tenant_dir(tenant_id)
+    return os.path.join(d, f"vectors.{generation}.bin"), os.path.join(d, f"meta.{generation}.bin")
+
+
+def _read_manifest(tenant_id: str) -> Optional[dict]:
+    try:
+        with open(_manifest_path(tenant_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_manifest(tenant_id: str, manifest: dict) -> None:
+    path = _manifest_path(tenant_id)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+@contextmanager
+def _locked(tenant_id: str) -> Iterator[None]:
+    os.makedirs(_tenant_dir(tenant_id), exist_ok=True)
+    with open(os.path.join(_tenant_dir(tenant_id), ".lock"), "a") as lock:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+
+def store_dim(width: int) -> int:
+    """Размерность компактного представления: EMBED_STORE_DIM, если задан и меньше исходной."""
+    dim = settings.EMBED_STORE_DIM
+    return dim if 0 < dim < width else width
+
+
+def encode(embeddings: Sequence[Sequence[float]], dtype: str, dim: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Усечь до ``dim``, нормализовать и привести к ``dtype``. Возвращает (codes, scales)."""
+    mat = np.asarray(embeddings, dtype=np.float32)
+    if mat.ndim != 2:
+        raise ValueError("embeddings must be a 2-D list of vectors")
+    mat = np.ascontiguousarray(mat[:, :dim])
+    mat /= np.maximum(np.linalg.norm(mat, axis=1, keepdims=True), 1e-8)
+    if dtype == "int8":
+        scales = np.maximum(np.abs(mat).max(axis=1), 1e-8) / 127.0
+        codes = np.rint(mat / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    return mat.astype(dtype, copy=False), np.ones(len(mat), dtype=np.float32)
+
+
+def score(codes: np.ndarray, scales: np.ndarray, q: np.ndarray) -> np.ndarray:
+    """Скоры компактных строк против нормализованного запроса той же размерности."""
+    return (codes.astype(np.float32, copy=False) @ q) * scales
+
+
+def prepare_query(query: Sequence[float], dim: int) -> Optional[np.ndarray]:
+    q = np.asarray(query, dtype=np.float32).reshape(-1)
+    if q.size < dim:
+        return None
+    q = np.array(q[:dim])
+    q /= max(float(np.linalg.norm(q)), 1e-8)
+    return q
+
+
+def _meta(rows: Sequence[Tuple[uuid.UUID, uuid.UUID, int]], scales: np.ndarray) -> np.ndarray:
+    meta = np.zeros(len(rows), dtype=META_DTYPE)
+    for i, (chunk_id, document_id, ordinal) in enumerate(rows):
+        meta[i] = (np.void(chunk_id.bytes), np.void(document_id.bytes), ordinal, scales[i])
+    return meta
+
+
+def append(
+    tenant_id: str,
+    rows: Sequence[Tuple[uuid.UUID, uuid.UUID, int]],
+    embeddings: Sequence[Sequence[float]],
+) -> None:
+    """Дописать строки (chunk_id, document_id, ordinal) и их эмбеддинги в конец файлов тенанта."""
+    if not rows:
+        return
+    with _locked(tenant_id):
+        manifest = _read_manifest(tenant_id)
+        width = len(embeddings[0])
+        if manifest is None:
+            manifest = {
+                "dim": store_dim(width), "dtype": settings.EMBED_STORE_DTYPE, "count": 0, "generation": 1,
+                "embed_model": embed_id(),
+            }
+        elif manifest.get("embed_model") != embed_id():
+            # Postgres — источник истины; хранилище другого провайдера не трогаем, search() его игнорирует
+            logger.warning(
+                "Embedding store for tenant %s was built by %s, not %s; rebuild it",
+                tenant_id, manifest.get("embed_model"), embed_id(),
+            )
+            return
+        elif width < manifest["dim"]:
+            raise ValueError(
+                f"Embedding dim {width} is smaller than store dim {manifest['dim']} for tenant {tenant_id}"
+            )
+        mat, scales = encode(embeddings, manifest["dtype"], manifest["dim"])
+        vec_path, meta_path = _files(tenant_id, manifest["generation"])
+        itemsize = np.dtype(manifest["dtype"]).itemsize * manifest["dim"]
+        # Обрезаем возможный хвост от прерванной записи, затем дописываем
+        for path, size in ((vec_path, itemsize), (meta_path, META_DTYPE.itemsize)):
+            with open(path, "ab") as f:
+                f.truncate(manifest["count"] * size)
+        with open(vec_path, "ab") as f:
+            f.write(mat.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(meta_path, "ab") as f:
+            f.write(_meta(rows, scales).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        manifest["count"] += len(rows)
+        _write_manifest(tenant_id, manifest)
+
+
+async def refresh_from_db(session: AsyncSession, tenant_id: str) -> int:
+    """Пересобрать хранилище тенанта из Postgres в новое поколение файлов.
+
+    Строки читаются серверным курсором блоками по ``_BLOCK_ROWS`` и сразу кодируются и
+    дописываются во временные файлы, так что в памяти не больше одного блока. Под flock
+    берётся только подмена: временные файлы становятся следующим поколением, manifest
+    переключается. Уже открытые отображения старого поколения остаются валидными до
+    перечитывания manifest.
+    """
+    os.makedirs(_tenant_dir(tenant_id), exist_ok=True)
+    build = _build_files(tenant_id)
+    dtype = settings.EMBED_STORE_DTYPE
+    dim: Optional[int] = None
+    width = 0
+    count = skipped = 0
+    try:
+        await asyncio.to_thread(_truncate, build)
+        result = await session.stream(
+            select(Chunk.id, Chunk.document_id, Chunk.ordinal, Chunk.embedding)
+            .where(Chunk.tenant_id == tenant_id, same_embedding())
+            .order_by(Chunk.document_id, Chunk.ordinal)
+            .execution_options(yield_per=_BLOCK_ROWS)
+        )
+        async for part in result.partitions():
+            rows: List[Tuple[uuid.UUID, uuid.UUID, int]] = []
+            vectors: List[List[float]] = []
+            for chunk_id, document_id, ordinal, emb in part:
+                if isinstance(emb, dict):
+                    emb = emb.get("v", [])
+                if not emb:
+                    continue
+                if dim is None:
+                    width, dim = len(emb), store_dim(len(emb))
+                elif len(emb) != width:
+                    skipped += 1
+                    continue
+                rows.append((chunk_id, document_id, ordinal))
+                vectors.append(emb)
+            if rows:
+                # Кодирование, запись и fsync блокируют — вне event loop
+                await asyncio.to_thread(_append_block, build, rows, vectors, dtype, dim)
+                count += len(rows)
+        if skipped:
+            logger.warning("Skipped %d chunks of tenant %s with embedding width other than %d", skipped, tenant_id, width)
+        await asyncio.to_thread(
+            _swap_generation, tenant_id, build, count, store_dim(settings.EMBED_DIM) if dim is None else dim, dtype,
+        )
+    finally:
+        for path in build:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    return count
+
+
+def _build_files(tenant_id: str) -> Tuple[str, str]:
+    d = _tenant_dir(tenant_id)
+    return os.path.join(d, f"vectors.build.{os.getpid()}.bin"), os.path.join(d, f"meta.build.{os.getpid()}.bin")
+
+
+def _truncate(paths: Sequence[str]) -> None:
+    for path in paths:
+        open(path, "wb").close()
+
+
+def _append_block(
+    build: Tuple[str, str], rows: List[Tuple[uuid.UUID, uuid.UUID, int]], vectors: List[List[float]], dtype: str, dim: int,
+) -> None:
+    mat, scales = encode(vectors, dtype, dim)
+    vec_path, meta_path = build
+    with open(vec_path, "ab") as f:
+        f.write(mat.tobytes())
+    with open(meta_path, "ab") as f:
+        f.write(_meta(rows, scales).tobytes())
+
+
+def _swap_generation(tenant_id: str, build: Tuple[str, str], count: int, dim: int, dtype: str) -> None:
+    for path in build:
+        with open(path, "ab") as f:
+            os.fsync(f.fileno())
+    with _locked(tenant_id):
+        old = _read_manifest(tenant_id)
+        generation = (old["generation"] + 1) if old else 1
+        for src, dst in zip(build, _files(tenant_id, generation)):
+            os.replace(src, dst)
+        _write_manifest(tenant_id, {
+            "dim": dim, "dtype": dtype, "count": count, "generation": generation, "embed_model": embed_id(),
+        })
+        if old:
+            # На POSIX уже отображённые файлы живут до закрытия последнего mmap
+            for path in _files(tenant_id, old["generation"]):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+def _open(tenant_id: str) -> Optional[Tuple[dict, np.ndarray, np.ndarray]]:
+    try:
+        mtime = os.stat(_manifest_path(tenant_id)).st_mtime_ns
+    except FileNotFoundError:
+        _maps.pop(tenant_id, None)
+        return None
+    cached = _maps.get(tenant_id)
+    if cached is not None and cached[0] == mtime:
+        return cached[1], cached[2], cached[3]
+
+    manifest = _read_manifest(tenant_id)
+    if manifest is None or manifest["count"] == 0:
+        return None
+    vec_path, meta_path = _files(tenant_id, manifest["generation"])
+    count, dim = manifest["count"], manifest["dim"]
+    vectors = np.memmap(vec_path, dtype=manifest["dtype"], mode="r", shape=(count, dim))
+    meta = np.memmap(meta_path, dtype=META_DTYPE, mode="r", shape=(count,))
+    _maps[tenant_id] = (mtime, manifest, vectors, meta)
+    return manifest, vectors, meta
+
+
+def search(
+    tenant_id: str,
+    query: Sequence[float],
+    k: int = 6,
+    document_id: Optional[uuid.UUID] = None,
+) -> Optional[List[Tuple[float, uuid.UUID]]]:
+    """Top-k (score, chunk_id) по компактному представлению (приближённый косинус).
+    None — хранилища нет или в нём нет строк документа."""
+    opened = _open(tenant_id)
+    if opened is None:
+        return None
+    manifest, vectors, meta = opened
+    if manifest.get("embed_model") != embed_id():
+        return None
+    q = prepare_query(query, manifest["dim"])
+    if q is None:
+        return None
+
+    if document_id is not None:
+        idx = np.flatnonzero(meta["document_id"] == np.void(document_id.bytes))
+        if idx.size == 0:
+            return None
+        scores = score(vectors[idx], meta["scale"][idx], q)
+    else:
+        idx = None
+        # Поблочно, чтобы float16/int8 не приводились к float32 целиком
+        scores = np.empty(manifest["count"], dtype=np.float32)
+        for start in range(0, manifest["count"], _BLOCK_ROWS):
+            block = vectors[start:start + _BLOCK_ROWS]
+            scores[start:start + len(block)] = score(block, meta["scale"][start:start + len(block)], q)
+
+    k = min(k, scores.size)
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    rows = top if idx is None else idx[top]
+    return [(float(scores[t]), uuid.UUID(bytes=bytes(meta["chunk_id"][r]))) for t, r in zip(top, rows)]
+
+
+def preload(tenant_id: str) -> int:
+    """Отобразить файлы тенанта и прочитать страницы в page cache (прогрев). Возвращает число строк."""
+    opened = _open(tenant_id)
+    if opened is None:
+        return 0
+    manifest, vectors, meta = opened
+    for start in range(0, manifest["count"], _BLOCK_ROWS):
+        vectors[start:start + _BLOCK_ROWS].sum()
+    meta["scale"].sum()
+    return manifest["count"]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from ..db import get_session_local
+
+    parser = argparse.ArgumentParser(description="Rebuild a tenant's memory-mapped embedding store from Postgres")
+    parser.add_argument("tenant_id")
+    args = parser.parse_args()
+
+    async def _main() -> None:
+        SessionLocal = get_session_local()
+        if SessionLocal is None:
+            raise SystemExit("Database is disabled")
+        async with SessionLocal() as session:
+            n = await refresh_from_db(session, args.tenant_id)
+        print(f"{args.tenant_id}: {n} vectors")
+
+    asyncio.run(_main())
@@ -0,0 +1,248 @@
+"""Версии документа с диффом на уровне чанков.
+
+Позиция чанка отделена от строки: ``chunk_positions`` хранит (версия, ordinal) → chunk_id,
+а ``Chunk.ordinal`` — позицию в последней версии, где строка действует. Чанк новой версии
+сопоставляется с действующими строками по sha256 текста, независимо от позиции:
+- хэш есть среди действующих строк — строка переиспользуется (при сдвиге меняется только ordinal);
+- хэш встречался, но все его строки уже заняты (повтор абзаца) — новая строка с копией эмбеддинга;
+- хэш новый — чанк эмбеддится заново.
+Вставка абзаца стоит одного эмбеддинга и одной строки, а не переписывания хвоста документа.
+Несопоставленные старые строки закрываются (``version_to``); прежние версии по-прежнему
+доступны для анализа через свои позиции.
+
+Эмбеддинги считаются до блокировки документа (``pending_chunks`` + ``embed_pending``), а
+``add_version`` под блокировкой заново строит план и берёт готовые векторы по хэшу текста.
+"""
+import hashlib
+import uuid
+from typing import Dict, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from sqlalchemy import Select, and_, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..models import Chunk, ChunkPosition, Document, DocumentVersion
+from .embedding import embed_id, embed_texts
+from .text_store import make_document_text
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def same_embedding():
+    """Условие на Chunk: вектор построен текущим провайдером эмбеддингов (тот же embed_id:
+    провайдер, модель и размерность). Строки с NULL (миграция 005 не заполнила) — чужие."""
+    return Chunk.embed_model == embed_id()
+
+
+def other_embedding():
+    """Условие на Chunk: вектор построен не текущим провайдером (отрицание ``same_embedding`` с учётом NULL)."""
+    return or_(Chunk.embed_model.is_(None), Chunk.embed_model != embed_id())
+
+
+def chunks_in_version(version: Optional[int], *columns) -> Tuple[Select, object]:
+    """SELECT ``columns`` по чанкам версии ``version`` (None — текущей) и колонка позиции в ней.
+
+    Текущая версия читается прямо из chunks (version_to IS NULL, Chunk.ordinal), указанная —
+    через chunk_positions. Позицию вызывающий код добавляет в выборку, фильтр или сортировку.
+    """
+    if version is None:
+        return select(*columns).where(Chunk.version_to.is_(None)), Chunk.ordinal
+    stmt = select(*columns).join(
+        ChunkPosition, and_(ChunkPosition.chunk_id == Chunk.id, ChunkPosition.version == version)
+    )
+    return stmt, ChunkPosition.ordinal
+
+
+def positions(document_id: UUID, version: int, chunk_ids: Sequence[UUID]) -> List[ChunkPosition]:
+    """Позиции версии: ``chunk_ids[i]`` стоит на месте ``i + 1``."""
+    return [
+        ChunkPosition(document_id=document_id, version=version, ordinal=i, chunk_id=cid)
+        for i, cid in enumerate(chunk_ids, start=1)
+    ]
+
+
+async def reembed_stale(
+    session_factory, document_id: UUID
+) -> Tuple[List[Tuple[UUID, UUID, int]], List[List[float]]]:
+    """Пересчитать текущим провайдером векторы строк документа (всех версий), построенные другим.
+
+    Так повторная загрузка того же файла после смены EMBED_PROVIDER переиндексирует документ.
+    Эмбеддинг — вне транзакции; запись идемпотентна. Возвращает ((chunk_id, document_id, ordinal),
+    векторы) для хранилища эмбеддингов.
+    """
+    async with session_factory() as session:  # type: AsyncSession
+        res = await session.execute(
+            select(Chunk.id, Chunk.document_id, Chunk.ordinal, Chunk.text)
+            .where(Chunk.document_id == document_id, other_embedding())
+            .order_by(Chunk.ordinal)
+        )
+        stale = res.all()
+    if not stale:
+        return [], []
+
+    texts = list(dict.fromkeys(t for _, _, _, t in stale))
+    by_text = dict(zip(texts, await embed_texts(texts)))
+    vectors = [by_text[t] for _, _, _, t in stale]
+    async with session_factory() as session:  # type: AsyncSession
+        await session.execute(update(Chunk), [
+            {"id": cid, "embedding": e, "embed_model": embed_id(), "content_hash": text_hash(t)}
+            for (cid, _, _, t), e in zip(stale, vectors)
+        ])
+        await session.commit()
+    return [(cid, did, ordinal) for cid, did, ordinal, _ in stale], vectors
+
+
+async def resolve_version(session: AsyncSession, tenant_id: str, document_id: UUID, version: Optional[int]) -> Optional[int]:
+    """Номер запрошенной (или текущей) версии; None — нет документа или такой версии."""
+    current = (await session.execute(
+        select(Document.version).where(Document.id == document_id, Document.tenant_id == tenant_id)
+    )).scalar_one_or_none()
+    if current is None:
+        return None
+    if version is None:
+        return current
+    return version if 1 <= version <= current else None
+
+
+def plan(
+    old: Sequence[Tuple[UUID, int, str]], new_hashes: Sequence[str]
+) -> Tuple[Dict[int, UUID], Dict[int, UUID], List[int], List[UUID]]:
+    """Сопоставить старые строки (id, ordinal, hash) с хэшами новых чанков (ordinal = индекс + 1).
+
+    Каждая старая строка занимает не больше одного места. Сначала строки остаются на своих
+    позициях, затем оставшиеся вхождения хэша забирают свободные строки по порядку ordinal.
+
+    Возвращает (keep — {индекс: id переиспользуемой строки}, copy — {индекс: id источника
+    эмбеддинга}, embed — индексы для эмбеддинга, close — id закрываемых строк).
+    """
+    free: Dict[str, List[Tuple[int, UUID]]] = {}
+    for cid, ordinal, h in sorted(old, key=lambda r: r[1]):
+        free.setdefault(h, []).append((ordinal, cid))
+    source = {h: rows[0][1] for h, rows in free.items()}
+
+    keep: Dict[int, UUID] = {}
+    for i, h in enumerate(new_hashes):
+        rows = free.get(h, [])
+        for j, (ordinal, cid) in enumerate(rows):
+            if ordinal == i + 1:
+                keep[i] = cid
+                del rows[j]
+                break
+
+    copy: Dict[int, UUID] = {}
+    embed: List[int] = []
+    for i, h in enumerate(new_hashes):
+        if i in keep:
+            continue
+        if free.get(h):
+            keep[i] = free[h].pop(0)[1]
+        elif h in source:
+            copy[i] = source[h]
+        else:
+            embed.append(i)
+    kept = set(keep.values())
+    close = [cid for cid, _, _ in old if cid not in kept]
+    return keep, copy, embed, close
+
+
+async def _active_rows(session: AsyncSession, document_id: UUID) -> Tuple[List[Tuple[UUID, int, str]], List[UUID]]:
+    """Действующие строки документа: (id, ordinal, hash) текущего провайдера и id строк других провайдеров."""
+    res = await session.execute(
+        select(Chunk.id, Chunk.ordinal, Chunk.content_hash, Chunk.text, same_embedding().label("same_embedding"))
+        .where(Chunk.document_id == document_id, Chunk.version_to.is_(None))
+    )
+    old, stale = [], []
+    for cid, ordinal, h, t, same in res.all():
+        # Векторы другого провайдера не переиспользуем — такие строки закрываются и эмбеддятся заново
+        if same:
+            old.append((cid, ordinal, h or text_hash(t)))
+        else:
+            stale.append(cid)
+    return old, stale
+
+
+async def pending_chunks(session: AsyncSession, document_id: UUID, chunks: List[str]) -> List[int]:
+    """Индексы чанков, которым по текущему плану нужен новый эмбеддинг."""
+    old, _ = await _active_rows(session, document_id)
+    return plan(old, [text_hash(c) for c in chunks])[2]
+
+
+async def embed_pending(chunks: List[str], pending: List[int]) -> Dict[str, List[float]]:
+    """Эмбеддинги чанков ``pending`` по хэшу текста. Вызывать вне транзакции: это запрос к API."""
+    if not pending:
+        return {}
+    vectors = await embed_texts([chunks[i] for i in pending])
+    return {text_hash(chunks[i]): e for i, e in zip(pending, vectors)}
+
+
+async def add_version(
+    session: AsyncSession,
+    doc: Document,
+    text: str,
+    filename: str,
+    content_hash: str,
+    chunks: List[str],
+    embedded: Optional[Dict[str, List[float]]] = None,
+) -> Tuple[DocumentVersion, List[Chunk], List[List[float]]]:
+    """Записать новую версию ``doc`` (строка документа должна быть заблокирована).
+
+    ``embedded`` — эмбеддинги, посчитанные заранее через ``embed_pending``. План строится заново
+    по текущим строкам; если документ успели изменить, недостающие чанки эмбеддятся здесь.
+    Возвращает (версия, новые строки чанков, их эмбеддинги).
+    """
+    old, stale = await _active_rows(session, doc.id)
+    new_hashes = [text_hash(c) for c in chunks]
+    keep, copy, embed, close = plan(old, new_hashes)
+    close += stale
+
+    embeddings: Dict[int, List[float]] = {}
+    embedded = embedded or {}
+    missing = [i for i in embed if new_hashes[i] not in embedded]
+    if missing:
+        for i, e in zip(missing, await embed_texts([chunks[i] for i in missing])):
+            embedded[new_hashes[i]] = e
+    for i in embed:
+        embeddings[i] = embedded[new_hashes[i]]
+    if copy:
+        res = await session.execute(select(Chunk.id, Chunk.embedding).where(Chunk.id.in_(set(copy.values()))))
+        source = {cid: emb for cid, emb in res.all()}
+        for i, cid in copy.items():
+            embeddings[i] = source[cid]
+
+    v = doc.version + 1
+    if close:
+        await session.execute(update(Chunk).where(Chunk.id.in_(close)).values(version_to=v))
+    # Сдвинутые строки меняют только ordinal; эмбеддинг (TOAST) не переписывается
+    old_ordinal = {cid: ordinal for cid, ordinal, _ in old}
+    moved = [{"id": cid, "ordinal": i + 1} for i, cid in keep.items() if old_ordinal[cid] != i + 1]
+    if moved:
+        await session.execute(update(Chunk), moved)
+
+    rows: List[Chunk] = []
+    chunk_ids: List[UUID] = []
+    for i in range(len(chunks)):
+        if i in keep:
+            chunk_ids.append(keep[i])
+            continue
+        c = Chunk(
+            id=uuid.uuid4(), document_id=doc.id, tenant_id=doc.tenant_id, ordinal=i + 1, text=chunks[i],
+            embedding=embeddings[i], content_hash=new_hashes[i], embed_model=embed_id(), version_from=v,
+        )
+        session.add(c)
+        rows.append(c)
+        chunk_ids.append(c.id)
+    await session.flush()
+    session.add_all(positions(doc.id, v, chunk_ids))
+
+    doc.version = v
+    doc.content = text[:10000]
+    doc.content_hash = content_hash
+    session.add(make_document_text(doc.id, text, version=v))
+    ver = DocumentVersion(
+        document_id=doc.id, version=v, filename=filename, content_hash=content_hash,
+        chunks=len(chunks), embedded=len(embed), reused=len(keep), removed=len(close),
+    )
+    session.add(ver)
+    return ver, rows, [embeddings[i] for i in sorted(embeddings)]
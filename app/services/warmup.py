@@ -0,0 +1,107 @@
+"""Прогрев при старте и проверка готовности (/ready).
+
+Прогрев идёт фоновой задачей из lifespan: порт открывается сразу (важно для health-check
+Render), а /ready отвечает 503, пока пул БД, соединения с провайдерами и кэши не прогреты.
+Ошибки прогрева не фатальны — они видны в ответе /ready, первый запрос просто будет медленнее.
+"""
+import asyncio
+import importlib
+import logging
+import time
+from typing import Any, Dict, Tuple
+
+from sqlalchemy import text
+
+from .. import db
+from ..config import settings
+from ..db import SKIP_DB, get_engine
+from .llm_router import breaker_snapshot
+
+logger = logging.getLogger(__name__)
+
+HEAVY_MODULES = ("numpy", "httpx", "openai", "pdfminer.high_level", "docx", "chardet")
+
+state: Dict[str, Any] = {"started": False, "done": False, "seconds": None, "errors": {}}
+
+
+async def _warm_imports() -> None:
+    for name in HEAVY_MODULES:
+        await asyncio.to_thread(importlib.import_module, name)
+
+
+async def _ping_db() -> None:
+    async with get_engine().connect() as conn:
+        await conn.execute(text("SELECT 1"))
+
+
+async def _warm_db() -> None:
+    # Соединения открываются одновременно и остаются в пуле
+    await asyncio.gather(*(_ping_db() for _ in range(max(1, settings.WARMUP_DB_CONNECTIONS))))
+
+
+async def _warm_providers() -> None:
+    from .llm import get_openai_client, get_pplx_client
+
+    if settings.PERPLEXITY_API_KEY:
+        # Любой ответ годится: важно установить TCP+TLS соединение в пуле клиента
+        await get_pplx_client().get("/", timeout=5.0)
+    if settings.OPENAI_API_KEY:
+        await get_openai_client().models.list()
+
+
+async def _warm_caches() -> None:
+    tenants = [t.strip() for t in settings.WARMUP_TENANTS.split(",") if t.strip()]
+    if not tenants or not settings.EMBED_STORE_ENABLED:
+        return
+    from . import vector_store
+
+    for tenant in tenants:
+        await asyncio.to_thread(vector_store.preload, tenant)
+
+
+async def run() -> None:
+    state["started"] = True
+    started = time.monotonic()
+    steps = {"imports": _warm_imports, "providers": _warm_providers, "caches": _warm_caches}
+    if not SKIP_DB:
+        steps["db"] = _warm_db
+
+    async def guarded(name: str, step) -> None:
+        try:
+            await asyncio.wait_for(step(), timeout=settings.WARMUP_TIMEOUT_S)
+        except Exception as e:
+            state["errors"][name] = repr(e)
+            logger.warning("Warmup step %s failed: %r", name, e)
+
+    await asyncio.gather(*(guarded(name, step) for name, step in steps.items()))
+    state["seconds"] = round(time.monotonic() - started, 3)
+    state["done"] = True
+
+
+async def readiness() -> Tuple[bool, Dict[str, Any]]:
+    checks: Dict[str, Any] = {}
+    ready = True
+    if settings.WARMUP_ON_STARTUP:
+        checks["warmup"] = {"done": state["done"], "seconds": state["seconds"], "errors": state["errors"]}
+        ready = state["done"]
+    if SKIP_DB:
+        checks["db"] = "disabled"
+    else:
+        try:
+            await asyncio.wait_for(_ping_db(), timeout=2.0)
+            checks["db"] = "ok"
+        except Exception as e:
+            checks["db"] = repr(e)
+            ready = False
+    # Открытый breaker не делает инстанс неготовым: роутер уходит на запасные цели
+    checks["llm"] = breaker_snapshot()
+    return ready, checks
+
+
+async def shutdown() -> None:
+    from .llm import aclose_clients
+
+    await aclose_clients()
+    # Не создаём engine ради закрытия, если он так и не понадобился
+    if db._engine is not None:
+        await db._engine.dispose()
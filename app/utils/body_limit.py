@@ -0,0 +1,49 @@
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+# Запас на границы multipart, заголовки частей и текстовые поля формы
+FORM_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadLimitMiddleware:
+    """Ограничение размера multipart-тела до того, как парсер запишет его в спул.
+
+    Запросы с ``Content-Length`` больше лимита отклоняются сразу (413), не читая тело.
+    Без заголовка (chunked) принятые байты считаются по мере чтения, и при превышении
+    чтение прерывается ``HTTPException(413)`` — FastAPI пробрасывает её из разбора формы.
+    """
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes + FORM_OVERHEAD_BYTES
+
+    def _too_large(self) -> str:
+        return f"File is too large. Maximum size is {self.max_bytes - FORM_OVERHEAD_BYTES} bytes."
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT"):
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        if not headers.get(b"content-type", b"").startswith(b"multipart/form-data"):
+            return await self.app(scope, receive, send)
+
+        try:
+            declared = int(headers.get(b"content-length", b"-1"))
+        except ValueError:
+            declared = -1
+        if declared > self.max_bytes:
+            response = JSONResponse({"detail": self._too_large()}, status_code=413, headers={"Connection": "close"})
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(413, self._too_large())
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,122 @@
+import json
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+class JsonFieldStream:
+    """Инкрементальный разбор JSON-объекта, приходящего токенами от LLM.
+
+    Отдаёт события, как только значение целиком получено:
+    - для ключей из ``scalars`` — ``(key, value)`` по завершении значения верхнего уровня;
+    - для ключей из ``arrays`` — ``(key, item)`` по каждому завершённому элементу массива.
+    Текст до первой ``{`` (например, ```json) игнорируется.
+    """
+
+    def __init__(self, scalars: Iterable[str] = ("summary",), arrays: Iterable[str] = ("risks", "checklist")):
+        self.scalars = set(scalars)
+        self.arrays = set(arrays)
+        self.buf = ""
+        self.pos = 0
+        self.root = -1  # индекс открывающей '{'
+        self.stack: List[str] = []
+        self.in_str = False
+        self.esc = False
+        self.expect_key = False
+        self.key: Optional[str] = None
+        self.key_start = 0
+        self.start: Optional[int] = None  # начало захватываемого значения
+        self.start_depth = 0
+        self.done = False
+        self.values: Dict[str, Any] = {}  # уже разобранные поля — для оборванного ответа
+
+    def feed(self, delta: str) -> List[Tuple[str, Any]]:
+        self.buf += delta
+        events: List[Tuple[str, Any]] = []
+        buf = self.buf
+        while self.pos < len(buf) and not self.done:
+            i = self.pos
+            ch = buf[i]
+            self.pos += 1
+            if self.root < 0:
+                if ch == "{":
+                    self.root = i
+                    self.stack.append("{")
+                    self.expect_key = True
+                continue
+            if self.in_str:
+                if self.esc:
+                    self.esc = False
+                elif ch == "\\":
+                    self.esc = True
+                elif ch == '"':
+                    self.in_str = False
+                    if len(self.stack) == 1 and self.expect_key:
+                        self.key = json.loads(buf[self.key_start:i + 1])
+                continue
+            if ch == '"':
+                self.in_str = True
+                if len(self.stack) == 1 and self.expect_key:
+                    self.key_start = i
+                else:
+                    self._mark(i)
+            elif ch in " \t\r\n":
+                continue
+            elif ch == ":":
+                if len(self.stack) == 1:
+                    self.expect_key = False
+            elif ch in "{[":
+                self._mark(i)
+                self.stack.append(ch)
+            elif ch in ",}]":
+                self._finish(i, events)
+                if ch == ",":
+                    if len(self.stack) == 1:
+                        self.expect_key = True
+                else:
+                    self.stack.pop()
+                    if not self.stack:
+                        self.done = True
+            else:
+                self._mark(i)
+        return events
+
+    def _capturing(self) -> bool:
+        depth = len(self.stack)
+        if depth == 1:
+            return self.key in self.scalars and not self.expect_key
+        return depth == 2 and self.stack[1] == "[" and self.key in self.arrays
+
+    def _mark(self, i: int) -> None:
+        if self.start is None and self._capturing():
+            self.start = i
+            self.start_depth = len(self.stack)
+
+    def _finish(self, i: int, events: List[Tuple[str, Any]]) -> None:
+        if self.start is None or len(self.stack) != self.start_depth:
+            return
+        raw = self.buf[self.start:i].strip()
+        self.start = None
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            return
+        key = self.key or ""
+        if key in self.arrays:
+            self.values.setdefault(key, []).append(value)
+        else:
+            self.values[key] = value
+        events.append((key, value))
+
+    def result(self) -> Dict[str, Any]:
+        """Итоговый объект. Оборванный JSON — поля, разобранные до обрыва;
+        если модель ответила не JSON — весь текст уходит в summary."""
+        if self.root >= 0:
+            end = self.buf.rfind("}")
+            try:
+                data = json.loads(self.buf[self.root:end + 1])
+                if isinstance(data, dict):
+                    return data
+            except ValueError:
+                pass
+            if self.values:
+                return {"summary": "", "risks": [], "checklist": [], **self.values}
+        return {"summary": self.buf, "risks": [], "checklist": []}
@@ -0,0 +1,20 @@
+import base64
+from datetime import datetime
+from typing import Tuple
+from uuid import UUID
+
+
+def encode_cursor(created_at: datetime, id_: UUID) -> str:
+    """Непрозрачный курсор keyset-пагинации по (created_at, id)."""
+    raw = f"{created_at.isoformat()}|{id_}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    """Обратное к encode_cursor; ValueError при повреждённом курсоре."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        created_at, id_ = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), UUID(id_)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
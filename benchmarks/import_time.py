@@ -0,0 +1,56 @@
+"""Время импорта приложения (холодный старт) и проверка ленивых импортов.
+
+    python benchmarks/import_time.py [--runs 5] [--max-seconds 1.5]
+
+Каждый прогон — отдельный процесс ``python -c "import app.main"``. Скрипт печатает
+медиану и завершится с кодом 1, если тяжёлые модули загружаются при старте
+или медиана превышает ``--max-seconds``.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ["numpy", "pdfminer", "docx", "chardet", "openai", "httpx"]
+
+PROBE = f"""
+import json, sys, time
+t = time.perf_counter()
+import app.main
+print(json.dumps({{"seconds": time.perf_counter() - t,
+                  "eager": [m for m in {HEAVY!r} if m in sys.modules]}}))
+"""
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=0.0, help="fail above this median (0 = no limit)")
+    args = parser.parse_args()
+
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    samples, eager = [], set()
+    for _ in range(args.runs):
+        out = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, env=env, check=True,
+                             capture_output=True, text=True).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        samples.append(result["seconds"])
+        eager.update(result["eager"])
+
+    median = statistics.median(samples)
+    print(f"import app.main: median {median * 1000:.0f} ms, min {min(samples) * 1000:.0f} ms over {args.runs} runs")
+    failed = False
+    if eager:
+        print(f"FAIL: heavy modules imported eagerly: {sorted(eager)}")
+        failed = True
+    if args.max_seconds and median > args.max_seconds:
+        print(f"FAIL: median import time above {args.max_seconds:.2f}s")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,24 @@
+-- Исходная схема (documents, chunks) — для новой пустой базы.
+-- Идемпотентно: на существующей базе ничего не меняет.
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS documents (
+    id UUID PRIMARY KEY,
+    tenant_id VARCHAR(64) NOT NULL,
+    filename VARCHAR(256) NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_documents_tenant_id ON documents (tenant_id);
+
+CREATE TABLE IF NOT EXISTS chunks (
+    id UUID PRIMARY KEY,
+    document_id UUID NOT NULL REFERENCES documents (id) ON DELETE CASCADE,
+    tenant_id VARCHAR(64) NOT NULL,
+    ordinal INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    embedding JSONB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_chunks_document_id ON chunks (document_id);
+CREATE INDEX IF NOT EXISTS ix_chunks_tenant_id ON chunks (tenant_id);
+
+COMMIT;
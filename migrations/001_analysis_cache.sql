@@ -0,0 +1,20 @@
+-- Кэш готовых ответов /v1/analyze/contract.
+-- Повторный запуск безопасен (IF NOT EXISTS).
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS analysis_cache (
+    id UUID PRIMARY KEY,
+    document_id UUID NOT NULL REFERENCES documents (id) ON DELETE CASCADE,
+    tenant_id VARCHAR(64) NOT NULL,
+    query_hash VARCHAR(64) NOT NULL,
+    model VARCHAR(128) NOT NULL,
+    prompt_version VARCHAR(64) NOT NULL,
+    response JSONB NOT NULL,
+    CONSTRAINT uq_analysis_cache_key UNIQUE (document_id, query_hash, model, prompt_version)
+);
+-- Модель, которая фактически ответила (роутер мог уйти на запасную)
+ALTER TABLE analysis_cache ADD COLUMN IF NOT EXISTS model_used VARCHAR(128);
+CREATE INDEX IF NOT EXISTS ix_analysis_cache_document_id ON analysis_cache (document_id);
+CREATE INDEX IF NOT EXISTS ix_analysis_cache_tenant_id ON analysis_cache (tenant_id);
+
+COMMIT;
@@ -0,0 +1,15 @@
+-- Дедупликация загрузок по sha256 и полный извлечённый текст (сжатый zstd/gzip).
+-- Повторный запуск безопасен (IF NOT EXISTS).
+BEGIN;
+
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64);
+CREATE INDEX IF NOT EXISTS ix_documents_content_hash ON documents (content_hash);
+
+CREATE TABLE IF NOT EXISTS document_texts (
+    document_id UUID PRIMARY KEY REFERENCES documents (id) ON DELETE CASCADE,
+    codec VARCHAR(8) NOT NULL,
+    size INTEGER NOT NULL,
+    data BYTEA NOT NULL
+);
+
+COMMIT;
@@ -0,0 +1,65 @@
+-- Версии документов с диффом на уровне чанков.
+-- Повторный запуск безопасен (IF NOT EXISTS / NOT EXISTS).
+BEGIN;
+
+-- documents: текущая версия
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;
+
+-- chunks: хэш текста и интервал версий [version_from, version_to)
+ALTER TABLE chunks ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64);
+ALTER TABLE chunks ADD COLUMN IF NOT EXISTS version_from INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE chunks ADD COLUMN IF NOT EXISTS version_to INTEGER;
+
+-- Позиции чанков по версиям: (версия, ordinal) → chunk_id; строка чанка переиспользуется при сдвиге.
+-- Для уже записанных строк позиция в каждой версии их интервала — текущий ordinal
+CREATE TABLE IF NOT EXISTS chunk_positions (
+    document_id UUID NOT NULL REFERENCES documents (id) ON DELETE CASCADE,
+    version INTEGER NOT NULL,
+    ordinal INTEGER NOT NULL,
+    chunk_id UUID NOT NULL REFERENCES chunks (id) ON DELETE CASCADE,
+    PRIMARY KEY (document_id, version, ordinal)
+);
+CREATE INDEX IF NOT EXISTS ix_chunk_positions_chunk_version ON chunk_positions (chunk_id, version);
+
+INSERT INTO chunk_positions (document_id, version, ordinal, chunk_id)
+SELECT c.document_id, v, c.ordinal, c.id
+FROM chunks c
+JOIN documents d ON d.id = c.document_id
+CROSS JOIN LATERAL generate_series(c.version_from, COALESCE(c.version_to - 1, d.version)) AS v
+ON CONFLICT DO NOTHING;
+
+-- Полный текст хранится по версиям
+ALTER TABLE document_texts ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE document_texts DROP CONSTRAINT IF EXISTS document_texts_pkey;
+ALTER TABLE document_texts ADD PRIMARY KEY (document_id, version);
+
+-- История версий; для уже загруженных документов — запись о версии 1
+CREATE TABLE IF NOT EXISTS document_versions (
+    id UUID PRIMARY KEY,
+    document_id UUID NOT NULL REFERENCES documents (id) ON DELETE CASCADE,
+    version INTEGER NOT NULL,
+    filename VARCHAR(256) NOT NULL,
+    content_hash VARCHAR(64) NOT NULL,
+    chunks INTEGER NOT NULL,
+    embedded INTEGER NOT NULL,
+    reused INTEGER NOT NULL,
+    removed INTEGER NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+    UNIQUE (document_id, version)
+);
+CREATE INDEX IF NOT EXISTS ix_document_versions_document_id ON document_versions (document_id);
+
+INSERT INTO document_versions (id, document_id, version, filename, content_hash, chunks, embedded, reused, removed)
+SELECT gen_random_uuid(), d.id, 1, d.filename, COALESCE(d.content_hash, ''),
+       (SELECT count(*) FROM chunks c WHERE c.document_id = d.id), 0, 0, 0
+FROM documents d
+WHERE NOT EXISTS (SELECT 1 FROM document_versions v WHERE v.document_id = d.id);
+
+-- Кэш анализа — по версии документа
+ALTER TABLE analysis_cache ADD COLUMN IF NOT EXISTS document_version INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE analysis_cache DROP CONSTRAINT IF EXISTS uq_analysis_cache_key;
+ALTER TABLE analysis_cache DROP CONSTRAINT IF EXISTS uq_analysis_cache_version_key;
+ALTER TABLE analysis_cache ADD CONSTRAINT uq_analysis_cache_version_key
+    UNIQUE (document_id, document_version, query_hash, model, prompt_version);
+
+COMMIT;
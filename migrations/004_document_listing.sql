@@ -0,0 +1,11 @@
+-- Списки документов и чанков: время создания и индексы под keyset-пагинацию.
+-- Повторный запуск безопасен (IF NOT EXISTS). На больших таблицах индексы можно
+-- заранее построить CREATE INDEX CONCURRENTLY вне транзакции.
+BEGIN;
+
+-- Существующие строки получают время применения миграции; порядок среди них задаёт id
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now();
+CREATE INDEX IF NOT EXISTS ix_documents_tenant_created_id ON documents (tenant_id, created_at, id);
+CREATE INDEX IF NOT EXISTS ix_chunks_document_ordinal ON chunks (document_id, ordinal);
+
+COMMIT;
@@ -0,0 +1,20 @@
+-- Провайдер эмбеддинга каждого чанка (embed_id: провайдер, модель, размерность).
+-- Повторный запуск безопасен (IF NOT EXISTS, заполняются только NULL).
+BEGIN;
+
+ALTER TABLE chunks ADD COLUMN IF NOT EXISTS embed_model VARCHAR(128);
+
+-- Чанки, загруженные до этой колонки, эмбеддились OpenAI без параметра dimensions,
+-- то есть в исходной размерности модели. Модель по умолчанию — text-embedding-3-small;
+-- если OPENAI_EMBED_MODEL был другим, замените её имя ниже (для моделей не из семейства
+-- text-embedding-3-* embed_id имеет вид 'openai:<model>:native'). Размерность берётся из самого
+-- вектора (в том числе старого формата {"v": [...]}), поэтому векторы разной ширины
+-- не получат одинаковый embed_id. Строки, оставшиеся NULL, пересчитываются при повторной загрузке.
+UPDATE chunks
+SET embed_model = 'openai:text-embedding-3-small:' || jsonb_array_length(
+    CASE WHEN jsonb_typeof(embedding) = 'array' THEN embedding ELSE embedding -> 'v' END
+)
+WHERE embed_model IS NULL
+  AND jsonb_typeof(CASE WHEN jsonb_typeof(embedding) = 'array' THEN embedding ELSE embedding -> 'v' END) = 'array';
+
+COMMIT;
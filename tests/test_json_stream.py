@@ -0,0 +1,83 @@
+from app.utils.json_stream import JsonFieldStream
+
+FULL = '{"summary": "Кратко", "risks": ["штраф", "срок"], "checklist": ["подписать"]}'
+
+
+def feed_all(parser, chunks):
+    events = []
+    for chunk in chunks:
+        events += parser.feed(chunk)
+    return events
+
+
+def test_events_in_order_when_fed_char_by_char():
+    parser = JsonFieldStream()
+    events = feed_all(parser, FULL)
+    assert events == [
+        ("summary", "Кратко"), ("risks", "штраф"), ("risks", "срок"), ("checklist", "подписать"),
+    ]
+    assert parser.result()["checklist"] == ["подписать"]
+
+
+def test_escapes_and_structural_chars_inside_strings():
+    raw = r'{"summary": "Он сказал \"нет\", см. {п. 1} [ред.] \\ конец", "risks": ["a, b]"]}'
+    parser = JsonFieldStream()
+    events = feed_all(parser, [raw[:20], raw[20:37], raw[37:]])
+    assert events == [
+        ("summary", 'Он сказал "нет", см. {п. 1} [ред.] \\ конец'),
+        ("risks", "a, b]"),
+    ]
+
+
+def test_escape_split_across_deltas():
+    parser = JsonFieldStream()
+    events = feed_all(parser, ['{"summary": "a\\', '"b"}'])
+    assert events == [("summary", 'a"b')]
+
+
+def test_nested_objects_are_emitted_whole_and_other_keys_ignored():
+    raw = (
+        '{"meta": {"summary": "не то", "risks": ["x"]}, '
+        '"risks": [{"title": "штраф", "level": {"n": 2}}, "срок"], "summary": "итог"}'
+    )
+    parser = JsonFieldStream()
+    events = feed_all(parser, raw)
+    assert events == [
+        ("risks", {"title": "штраф", "level": {"n": 2}}),
+        ("risks", "срок"),
+        ("summary", "итог"),
+    ]
+
+
+def test_markdown_preamble_is_skipped():
+    raw = "Вот ответ:\n```json\n" + FULL + "\n```"
+    parser = JsonFieldStream()
+    events = feed_all(parser, [raw[:8], raw[8:30], raw[30:]])
+    assert [k for k, _ in events] == ["summary", "risks", "risks", "checklist"]
+    assert parser.result()["summary"] == "Кратко"
+
+
+def test_null_and_non_string_scalars():
+    parser = JsonFieldStream()
+    assert feed_all(parser, '{"summary": null, "risks": []}') == [("summary", None)]
+    assert parser.result() == {"summary": None, "risks": []}
+
+
+def test_truncated_output_keeps_completed_fields():
+    raw = '{"summary": "Кратко", "risks": ["штраф", "ср'
+    parser = JsonFieldStream()
+    assert feed_all(parser, raw) == [("summary", "Кратко"), ("risks", "штраф")]
+    assert parser.result() == {"summary": "Кратко", "risks": ["штраф"], "checklist": []}
+
+
+def test_truncated_before_any_field_falls_back_to_text():
+    raw = '```json\n{"summ'
+    parser = JsonFieldStream()
+    assert feed_all(parser, raw) == []
+    assert parser.result() == {"summary": raw, "risks": [], "checklist": []}
+
+
+def test_plain_text_answer_goes_to_summary():
+    parser = JsonFieldStream()
+    assert feed_all(parser, "Не могу ответить") == []
+    assert parser.result() == {"summary": "Не могу ответить", "risks": [], "checklist": []}
@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+
+from app.config import settings
+from app.services import llm_router
+from app.services.llm_router import (
+    CircuitBreaker, DeadlineExceeded, RequestRejected, TargetUnavailable, get_breaker, hedged_call,
+)
+
+A = ("perplexity", "a")
+B = ("perplexity", "b")
+C = ("openai", "c")
+
+
+@pytest.fixture(autouse=True)
+def router_state(monkeypatch):
+    monkeypatch.setattr(llm_router, "_breakers", {})
+    monkeypatch.setattr(llm_router, "_latencies", {})
+    monkeypatch.setattr(settings, "LLM_HEDGE_ENABLED", True)
+    monkeypatch.setattr(settings, "LLM_HEDGE_MAX", 1)
+    monkeypatch.setattr(settings, "LLM_HEDGE_DELAY_S", 0.05)
+    monkeypatch.setattr(settings, "LLM_BREAKER_MIN_CALLS", 2)
+    monkeypatch.setattr(settings, "LLM_BREAKER_ERROR_RATE", 0.5)
+
+
+def scripted(behaviour, calls):
+    """call() для hedged_call: behaviour[target] = (задержка, результат или исключение)."""
+    async def call(target, timeout):
+        calls.append(target)
+        delay, outcome = behaviour[target]
+        await asyncio.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    return call
+
+
+def test_breaker_opens_on_error_rate_and_recovers_through_half_open():
+    br = CircuitBreaker(window=4, min_calls=2, error_rate=0.5, cooldown_s=30)
+    br.record(True)
+    br.record(False)
+    assert br.state == "open"
+    assert not br.allow()
+
+    br.opened_at -= 30
+    assert br.allow()
+    assert br.state == "half_open"
+    assert not br.allow()  # одна проба за раз
+    br.record(True)
+    assert br.state == "closed"
+    assert br.allow()
+
+
+def test_breaker_failed_probe_reopens_and_release_frees_probe():
+    br = CircuitBreaker(window=4, min_calls=2, error_rate=0.5, cooldown_s=30)
+    br._trip()
+    br.opened_at -= 30
+    assert br.allow()
+    br.release()
+    assert br.allow()
+    br.record(False)
+    assert br.state == "open"
+    assert not br.allow()
+
+
+def test_hedge_fires_when_primary_is_slow():
+    calls = []
+    call = scripted({A: (1.0, "slow"), B: (0.01, "fast")}, calls)
+    assert asyncio.run(hedged_call([A, B], call, deadline_s=2)) == "fast"
+    assert calls == [A, B]
+
+
+def test_no_hedge_when_primary_answers_in_time():
+    calls = []
+    call = scripted({A: (0.01, "a"), B: (0.01, "b")}, calls)
+    assert asyncio.run(hedged_call([A, B], call, deadline_s=2)) == "a"
+    assert calls == [A]
+
+
+def test_fallback_on_error_and_breaker_records_failure(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_HEDGE_ENABLED", False)
+    calls = []
+    call = scripted({A: (0, RuntimeError("boom")), B: (0, "b")}, calls)
+    assert asyncio.run(hedged_call([A, B], call, deadline_s=2)) == "b"
+    assert calls == [A, B]
+    assert list(get_breaker(A).window) == [False]
+    assert list(get_breaker(B).window) == [True]
+
+
+def test_target_unavailable_is_skipped_without_breaker_failure(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_HEDGE_ENABLED", False)
+    calls = []
+    call = scripted({A: (0, TargetUnavailable("invalid_model")), B: (0, "b")}, calls)
+    assert asyncio.run(hedged_call([A, B], call, deadline_s=2)) == "b"
+    assert list(get_breaker(A).window) == []
+
+
+def test_unavailable_hedge_is_replaced_without_using_hedge_budget():
+    calls = []
+    call = scripted({
+        A: (1.0, "slow"), B: (0, TargetUnavailable("invalid_model")), C: (0.01, "c"),
+    }, calls)
+    assert asyncio.run(hedged_call([A, B, C], call, deadline_s=2)) == "c"
+    assert calls == [A, B, C]
+
+
+def test_rejected_request_stops_routing_without_breaker_failure(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_HEDGE_ENABLED", False)
+    calls = []
+    call = scripted({A: (0, RequestRejected("401")), B: (0, "b"), C: (0, "c")}, calls)
+    with pytest.raises(RequestRejected):
+        asyncio.run(hedged_call([A, B, C], call, deadline_s=2))
+    assert calls == [A]
+    assert list(get_breaker(A).window) == []
+
+
+def test_deadline_exceeded_counts_against_breaker(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_HEDGE_ENABLED", False)
+    calls = []
+    call = scripted({A: (1.0, "late")}, calls)
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(hedged_call([A], call, deadline_s=0.05))
+    assert list(get_breaker(A).window) == [False]
+
+
+def test_open_breaker_is_skipped():
+    get_breaker(A)._trip()
+    calls = []
+    call = scripted({A: (0, "a"), B: (0, "b")}, calls)
+    assert asyncio.run(hedged_call([A, B], call, deadline_s=2)) == "b"
+    assert calls == [B]
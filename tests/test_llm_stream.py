@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from app.config import settings
+from app.services import llm, llm_router
+from app.services.llm_router import get_breaker
+
+A = ("perplexity", "a")
+C = ("openai", "c")
+
+
+@pytest.fixture(autouse=True)
+def router_state(monkeypatch):
+    monkeypatch.setattr(llm_router, "_breakers", {})
+    monkeypatch.setattr(llm_router, "_latencies", {})
+    monkeypatch.setattr(settings, "LLM_BREAKER_MIN_CALLS", 2)
+    monkeypatch.setattr(settings, "LLM_BREAKER_ERROR_RATE", 0.5)
+    monkeypatch.setattr(llm, "_targets", lambda force_model, cheap_first: [A, C])
+
+
+async def stalled(model, messages, temperature, timeout, json_schema):
+    await asyncio.sleep(1.0)
+    yield "late"
+
+
+async def fast(model, messages, temperature, timeout, json_schema):
+    yield '{"summary": "ok"}'
+
+
+async def collect(deadline):
+    return [item async for item in llm.chat_stream("sys", "user", deadline=deadline)]
+
+
+def test_deadline_does_not_reserve_half_open_probe(monkeypatch):
+    monkeypatch.setattr(llm, "_pplx_stream", stalled)
+    monkeypatch.setattr(llm, "_openai_stream", fast)
+    br = get_breaker(C)
+    br._trip()
+    br.opened_at -= br.cooldown_s
+
+    with pytest.raises(llm.LLMServiceError):
+        asyncio.run(collect(deadline=0.1))
+    assert list(get_breaker(A).window) == [False]
+    # До запасной цели дело не дошло — её проба свободна
+    assert br.allow()
+
+
+async def broken(model, messages, temperature, timeout, json_schema):
+    raise llm.LLMServiceError("502")
+    yield
+
+
+def test_falls_back_when_first_target_fails_before_first_token(monkeypatch):
+    monkeypatch.setattr(llm, "_pplx_stream", broken)
+    monkeypatch.setattr(llm, "_openai_stream", fast)
+    assert asyncio.run(collect(deadline=5)) == [("c", '{"summary": "ok"}')]
+    assert list(get_breaker(A).window) == [False]
+    assert list(get_breaker(C).window) == [True]
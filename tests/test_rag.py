@@ -0,0 +1,17 @@
+from app.services.rag import build_response
+
+
+def test_build_response_coerces_off_schema_llm_output():
+    resp = build_response({"summary": None, "risks": "штраф", "checklist": None, "model": None}, "вопрос", [])
+    assert resp.summary == ""
+    assert resp.risks[0] == "штраф"
+    assert resp.checklist == []
+    assert resp.model == "unknown"
+
+
+def test_build_response_flattens_object_items():
+    resp = build_response(
+        {"summary": "ok", "risks": [{"title": "штраф"}, None], "checklist": [1]}, "вопрос", []
+    )
+    assert resp.risks[0] == "штраф"
+    assert resp.checklist == ["1"]
@@ -0,0 +1,42 @@
+import uuid
+
+import pytest
+
+from app.services import text_store
+from app.services.text_store import compress_text, decompress_text, make_document_text
+
+TEXT = "Договор поставки №1\n\nПункт 2.1: неустойка 0,5% — «в день».\n" * 200
+
+
+def test_round_trip_with_default_codec():
+    codec, data = compress_text(TEXT)
+    assert codec == ("zstd" if text_store.zstandard is not None else "gzip")
+    assert len(data) < len(TEXT.encode("utf-8"))
+    assert decompress_text(codec, data) == TEXT
+
+
+def test_gzip_fallback_without_zstandard(monkeypatch):
+    monkeypatch.setattr(text_store, "zstandard", None)
+    codec, data = compress_text(TEXT)
+    assert codec == "gzip"
+    assert decompress_text(codec, data) == TEXT
+
+
+def test_zstd_text_requires_zstandard(monkeypatch):
+    if text_store.zstandard is None:
+        pytest.skip("zstandard is not installed")
+    codec, data = compress_text(TEXT)
+    monkeypatch.setattr(text_store, "zstandard", None)
+    with pytest.raises(RuntimeError):
+        decompress_text(codec, data)
+
+
+def test_unknown_codec_is_rejected():
+    with pytest.raises(ValueError):
+        decompress_text("lz4", b"")
+
+
+def test_make_document_text_records_codec_and_size():
+    row = make_document_text(uuid.uuid4(), TEXT, version=3)
+    assert (row.version, row.size) == (3, len(TEXT))
+    assert decompress_text(row.codec, row.data) == TEXT
@@ -0,0 +1,73 @@
+import uuid
+
+from app.services.versioning import plan
+
+
+def rows(hashes):
+    """Старые действующие строки (id, ordinal, hash) в порядке ``hashes``."""
+    return [(uuid.uuid4(), i, h) for i, h in enumerate(hashes, start=1)]
+
+
+def ids(old):
+    return [cid for cid, _, _ in old]
+
+
+def test_unchanged_keeps_every_row():
+    old = rows(["a", "b", "c"])
+    keep, copy, embed, close = plan(old, ["a", "b", "c"])
+    assert keep == dict(enumerate(ids(old)))
+    assert (copy, embed, close) == ({}, [], [])
+
+
+def test_insert_reuses_shifted_rows():
+    hashes = [f"h{i}" for i in range(52)]
+    old = rows(hashes)
+    new = hashes[:10] + ["new"] + hashes[10:]
+    keep, copy, embed, close = plan(old, new)
+    assert len(keep) == 52
+    assert embed == [10]
+    assert (copy, close) == ({}, [])
+    # Строки после вставки сдвинуты на одну позицию, но это те же строки
+    assert keep[11] == old[10][0]
+    assert keep[52] == old[51][0]
+
+
+def test_delete_closes_only_removed_row():
+    old = rows(["a", "b", "c", "d"])
+    keep, copy, embed, close = plan(old, ["a", "c", "d"])
+    assert keep == {0: old[0][0], 1: old[2][0], 2: old[3][0]}
+    assert (copy, embed) == ({}, [])
+    assert close == [old[1][0]]
+
+
+def test_move_reuses_rows():
+    old = rows(["a", "b", "c"])
+    keep, copy, embed, close = plan(old, ["c", "a", "b"])
+    assert keep == {0: old[2][0], 1: old[0][0], 2: old[1][0]}
+    assert (copy, embed, close) == ({}, [], [])
+
+
+def test_duplicate_hash_prefers_same_position_then_copies():
+    old = rows(["a", "x", "a"])
+    keep, copy, embed, close = plan(old, ["a", "a", "a", "y"])
+    # Обе строки "a" остаются на своих позициях, лишнее вхождение копирует эмбеддинг
+    assert keep == {0: old[0][0], 2: old[2][0]}
+    assert copy == {1: old[0][0]}
+    assert embed == [3]
+    assert close == [old[1][0]]
+
+
+def test_duplicate_hash_extra_old_rows_are_closed():
+    old = rows(["a", "a", "a"])
+    keep, copy, embed, close = plan(old, ["a"])
+    assert keep == {0: old[0][0]}
+    assert (copy, embed) == ({}, [])
+    assert close == [old[1][0], old[2][0]]
+
+
+def test_new_document_embeds_everything():
+    keep, copy, embed, close = plan([], ["a", "b", "a"])
+    assert keep == {}
+    assert copy == {}
+    assert embed == [0, 1, 2]
+    assert close == []